@@ -1,3 +1,6 @@
-from .base import VWBase, ObjectDeletedError, NoResultsFound, VWCollection
+from .base import VWBase, ObjectDeletedError, NoResultsFound, VWCollection, VWMultiSearch, MultiSearchError, \
+    VersionConflictError
 from .relationship import relationship
+from .identity import IdentityMap
+from .session import VWSession
 from .version import __version__
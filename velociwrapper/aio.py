@@ -0,0 +1,614 @@
+""" asyncio versions of the collection and model I/O. Requires Python 3.6+ and AsyncElasticsearch """
+
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+
+from elasticsearch import NotFoundError, TransportError, ConflictError, helpers
+from elasticsearch import ConnectionError as ESConnectionError
+
+from . import config, connection, identity, cache
+from .config import logger
+from .bulk import _is_rejected, expand_action
+from .base import VWCollection, VWCollectionGen, VWMultiSearch, VWSnapshot, Page, NoResultsFound, \
+    VersionConflictError
+from .relationship import load
+
+
+async def _aiter(items):
+    # accepts plain and async iterables
+    if hasattr(items, '__aiter__'):
+        async for i in items:
+            yield i
+    else:
+        for i in items:
+            yield i
+
+
+async def _chunk_actions(actions, chunk_size, max_chunk_bytes, serializer):
+    # yields lists of (action, lines) with the lines already serialized for the bulk body
+    chunk = []
+    size = 0
+    async for action in _aiter(actions):
+        meta, data = expand_action(action)
+        lines = [serializer.dumps(meta)]
+        if data is not None:
+            lines.append(serializer.dumps(data))
+
+        length = sum(len(line.encode('utf-8')) + 1 for line in lines)
+        if chunk and (len(chunk) >= chunk_size or size + length > max_chunk_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+
+        chunk.append((meta, lines))
+        size += length
+
+    if chunk:
+        yield chunk
+
+
+def _failed_item(meta, status, error):
+    op_type, info = next(iter(meta.items()))
+    info = dict(info)
+    info.update({'status': status, 'error': error})
+    return {op_type: info}
+
+
+async def _send_chunk(client, chunk, max_retries, initial_backoff, max_backoff, **kwargs):
+    # async version of bulk._send_chunk()
+    results = [None] * len(chunk)
+    pending = list(range(len(chunk)))
+    attempt = 0
+
+    while pending:
+        body = '\n'.join(line for i in pending for line in chunk[i][1]) + '\n'
+        try:
+            resp = await client.bulk(body=body, **kwargs)
+            items = resp['items']
+        except TransportError as e:
+            # the whole request failed so every document in it did
+            items = [_failed_item(chunk[i][0], e.status_code, str(e)) for i in pending]
+
+        retry = []
+        for i, item in zip(pending, items):
+            op_type, info = next(iter(item.items()))
+            # the status is 'N/A' when the request never reached the server
+            status = info.get('status')
+            ok = isinstance(status, int) and 200 <= status < 300
+            results[i] = (ok, item)
+            if not ok and attempt < max_retries and _is_rejected(item):
+                retry.append(i)
+
+        if retry:
+            delay = min(max_backoff, initial_backoff * 2 ** attempt)
+            logger.warning('%i document(s) rejected by the cluster. Retrying in %s seconds' % (len(retry), delay))
+            await asyncio.sleep(delay)
+
+        pending = retry
+        attempt += 1
+
+    return results
+
+
+async def streaming_bulk(client, actions, chunk_size=None, max_chunk_bytes=None, thread_count=None,
+                         max_retries=None, initial_backoff=None, max_backoff=None, **kwargs):
+    """
+    Async version of velociwrapper.bulk.streaming_bulk(). ``actions`` may be a
+    plain or async iterable. ``thread_count`` chunks are sent concurrently.
+    Yields (ok, item) in the order the actions were given.
+    """
+    chunk_size = chunk_size or config.bulk_chunk_size
+    max_chunk_bytes = max_chunk_bytes or config.bulk_max_chunk_bytes
+    thread_count = thread_count or config.bulk_thread_count
+
+    send_kwargs = {
+        'max_retries': config.bulk_max_retries if max_retries is None else max_retries,
+        'initial_backoff': config.bulk_initial_backoff if initial_backoff is None else initial_backoff,
+        'max_backoff': config.bulk_max_backoff if max_backoff is None else max_backoff
+    }
+    send_kwargs.update(kwargs)
+
+    pending = []
+    async for chunk in _chunk_actions(actions, chunk_size, max_chunk_bytes, client.transport.serializer):
+        pending.append(_send_chunk(client, chunk, **send_kwargs))
+        if len(pending) >= thread_count:
+            for results in await asyncio.gather(*pending):
+                for result in results:
+                    yield result
+            pending = []
+
+    if pending:
+        for results in await asyncio.gather(*pending):
+            for result in results:
+                yield result
+
+
+async def bulk(client, actions, raise_on_error=True, **kwargs):
+    """ Async version of velociwrapper.bulk.bulk() """
+    success = 0
+    errors = []
+    async for ok, item in streaming_bulk(client, actions, **kwargs):
+        if ok:
+            success += 1
+        else:
+            errors.append(item)
+
+    if errors and raise_on_error:
+        raise helpers.BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+
+    return success, errors
+
+
+async def commit_model(model, update=False, check_version=None, **kwargs):
+    """ Async version of VWBase.commit(). Usually called as ``await model.async_commit()`` """
+    es = connection.get_async_connection(model.__connection__)
+
+    if check_version is None:
+        check_version = model.__check_version__
+
+    identity.discard(model.__index__, model.__type__, model.id)
+    cache.invalidate(model.__index__)
+
+    try:
+        if model._deleted and hasattr(model, 'id') and model.id:
+            model.execute_callbacks('on_delete')
+            await es.delete(**model._create_delete_params(check_version))
+        elif update:
+            model._check_deferred()
+            model.execute_callbacks('before_commit')
+            params = model._create_update_params(check_version=check_version, **kwargs)
+            if params is not None:
+                model._set_version(await es.update(**params))
+            model._watch = True
+            object.__setattr__(model, '_new', False)
+            model._reset_changes()
+            model.execute_callbacks('after_commit')
+        else:
+            model._check_deferred()
+            model.execute_callbacks('before_commit')
+            model._set_version(await es.index(**model._create_index_params(check_version, **kwargs)))
+            model._watch = True
+            object.__setattr__(model, '_new', False)
+            model._reset_changes()
+            model.execute_callbacks('after_commit')
+    except ConflictError as e:
+        raise VersionConflictError(model, e.status_code, e.error, e.info)
+
+
+async def commit_with_retry(model, mutate, retries=3, **kwargs):
+    """ Async version of VWBase.commit_with_retry(). mutate may be a coroutine function """
+    attempt = 0
+    while True:
+        result = mutate(model)
+        if asyncio.iscoroutine(result):
+            await result
+
+        try:
+            await commit_model(model, check_version=True, **kwargs)
+            return model
+        except VersionConflictError:
+            attempt += 1
+            if attempt > retries:
+                raise
+
+            await sync_model(model)
+
+
+async def sync_model(model):
+    """ Async version of VWBase.sync(). Usually called as ``await model.async_sync()`` """
+    if not model.id:
+        raise AttributeError('Object is not committed')
+
+    es = connection.get_async_connection(model.__connection__)
+    try:
+        model.execute_callbacks('before_sync')
+        res = await es.get(id=model.id, index=model.__index__)
+        model._document = res.get('_source')
+        model._set_version(res)
+
+        model._new = False
+        model.execute_callbacks('after_sync')
+
+    except NotFoundError:
+        # not found in elastic search means we should treat as new
+        model._new = True
+
+
+class AsyncVWCollection(VWCollection):
+    """
+    Collection that sends its requests with AsyncElasticsearch. Queries are built
+    the same way as VWCollection but the methods that talk to the server are
+    coroutines (iter_all() is an async generator).
+    """
+    __async__ = True
+
+    @property
+    def _es(self):
+        return connection.get_async_connection(self.connection)
+
+    @property
+    def _esc(self):
+        return self._es.indices
+
+    async def get(self, id, **kwargs):
+        identity_map, known, missing = self._identity_split([id], kwargs)
+        if known:
+            return known[self._get_many_key(id)]
+
+        try:
+            doc = await self._es.get(**self._create_get_params(id, **kwargs))
+            if doc:
+                return (await self._create_identity_results(identity_map, [id], known, {'docs': [doc]}))[0]
+
+            return None
+
+        except (NotFoundError, TransportError):
+            return None
+
+    async def refresh(self, **kwargs):
+        await self._esc.refresh(index=self.idx, **kwargs)
+
+    async def get_in(self, ids, **kwargs):
+        identity_map, known, missing = self._identity_split(ids, kwargs)
+
+        res = None
+        params = self._create_mget_params(missing, **kwargs)
+        if params:
+            res = await self._es.mget(**params)
+
+        return await self._create_identity_results(identity_map, ids, known, res)
+
+    async def get_many(self, ids, chunk_size=None, parallel=None, as_dict=False, **kwargs):
+        identity_map, found, chunks = self._create_get_many_chunks(ids, chunk_size, kwargs)
+        parallel = parallel or config.bulk_thread_count
+
+        # up to parallel requests at once
+        for i in range(0, len(chunks), parallel):
+            window = chunks[i:i + parallel]
+            responses = await asyncio.gather(*[self._es.mget(**self._create_mget_params(chunk, **kwargs))
+                                               for chunk in window])
+            for chunk, res in zip(window, responses):
+                self._add_get_many_models(found, await self._create_identity_results(identity_map, chunk, {}, res))
+
+        return self._create_get_many_output(ids, found, as_dict)
+
+    async def _create_identity_results(self, identity_map, ids, known, res):
+        merged = self._merge_identity_results(ids, known, res)
+        if merged is None:
+            return []
+
+        results = await self._create_results(*merged)
+        self._add_identity_results(identity_map, known, results)
+        return results
+
+    async def get_like_this(self, doc_id, **kwargs):
+        params = {'index': self.idx, 'doc_type': self.type, 'id': doc_id}
+        params.update(kwargs)
+        res = await self._es.mlt(**params)
+
+        if res and res.get('docs'):
+            return VWCollectionGen(self.base_obj, res)
+        else:
+            return []
+
+    async def count(self):
+        params = self._create_search_params()
+        resp = await self._cached_request('count', params)
+        return resp.get('count')
+
+    async def _cached_request(self, op, params):
+        key, results = self._cache_lookup(op, params)
+        if results is None:
+            results = await getattr(self._es, op)(**params)
+            self._cache_store(key, params, results)
+
+        return results
+
+    def __len__(self):
+        raise TypeError('len() is not supported on async collections. Use "await collection.count()"')
+
+    async def all(self, as_dict=False, **kwargs):
+        if as_dict:
+            return await self.values(**kwargs)
+
+        params = self._create_page_params(**kwargs)
+        results = await self._cached_request('search', params)
+
+        return await self._create_results(results)
+
+    def snapshot(self, keep_alive='5m', per_page=None, tiebreaker='_shard_doc', **kwargs):
+        """ Returns an AsyncVWSnapshot. Use with ``async with`` """
+        return AsyncVWSnapshot(self, keep_alive=keep_alive, per_page=per_page, tiebreaker=tiebreaker, **kwargs)
+
+    async def paginate(self, page=1, per_page=None, track_total_hits=None, **kwargs):
+        page, per_page, params = self._create_paginate_params(page, per_page, track_total_hits, **kwargs)
+        results = await self._cached_request('search', params)
+        return await self._create_results(results, cls=Page, page=page, per_page=per_page)
+
+    async def _create_results(self, results, objects=None, cls=None, **kwargs):
+        gen = self._create_gen(results, objects, cls, **kwargs)
+
+        if self._options:
+            models = gen._models()
+            for option in self._options:
+                if isinstance(option, load):
+                    await self._preload(option, models)
+                else:
+                    option.apply(self.base_obj, models)
+
+        return gen
+
+    # async version of relationship.preload()
+    async def _preload(self, option, models):
+        for name, rel in option.relationships(self.base_obj):
+            keys = rel.preload_keys(models)
+            if not keys or not keys[2]:
+                continue
+
+            field, pairs, values = keys
+            c = AsyncVWCollection(base_obj=rel._get_ref_model())
+            if field == 'id':
+                related = await c.get_in(values)
+            else:
+                related = [obj async for obj in c.filter_by(**{field: values}).iter_all()]
+
+            rel.attach(name, field, pairs, related, limit=c.results_per_page)
+
+    async def values(self, *fields, **kwargs):
+        params = self._create_page_params(source_fields=fields, **kwargs)
+        results = await self._cached_request('search', params)
+        return list(self._raw_results(results, fields))
+
+    async def iter_raw(self, *fields, **kwargs):
+        """ Async generator version of VWCollection.iter_raw() """
+        pages = self._iter_pages(source_fields=fields, **kwargs)
+        try:
+            async for results in pages:
+                for row in self._raw_results(results, fields):
+                    yield row
+        finally:
+            await pages.aclose()
+
+    async def one(self, **kwargs):
+        kwargs['results_per_page'] = 1
+        results = await self.all(**kwargs)
+        try:
+            return results[0]
+        except IndexError:
+            raise NoResultsFound('No result found for one()')
+
+    async def _iter_pages(self, scroll='5m', search_after=False, tiebreaker='_uid', **kwargs):
+        params = self._create_stream_params(scroll=scroll, search_after=search_after, tiebreaker=tiebreaker,
+                                            **kwargs)
+
+        if search_after:
+            while True:
+                results = await self._es.search(**params)
+                hits = results['hits']['hits']
+                if not hits:
+                    break
+
+                yield results
+
+                if len(hits) < params['size']:
+                    break
+
+                params['body']['search_after'] = hits[-1]['sort']
+
+        else:
+            scroll_id = None
+            try:
+                results = await self._es.search(**params)
+                while True:
+                    scroll_id = results.get('_scroll_id')
+                    if not results['hits']['hits']:
+                        break
+
+                    yield results
+
+                    results = await self._es.scroll(scroll_id=scroll_id, scroll=scroll)
+            finally:
+                if scroll_id:
+                    try:
+                        await self._es.clear_scroll(scroll_id=scroll_id)
+                    except TransportError:
+                        logger.debug('Failed to clear scroll %s' % scroll_id)
+
+    async def iter_all(self, scroll='5m', search_after=False, tiebreaker='_uid', **kwargs):
+        """ Async generator version of VWCollection.iter_all(). Use with ``async for`` """
+        pages = self._iter_pages(scroll=scroll, search_after=search_after, tiebreaker=tiebreaker, **kwargs)
+        try:
+            async for results in pages:
+                for obj in await self._create_results(results):
+                    yield obj
+        finally:
+            await pages.aclose()
+
+    stream = iter_all
+
+    async def delete(self, progress=None, by_query=False, parallel=None, **kwargs):
+        identity.invalidate(self.idx, self.type)
+        cache.invalidate(self.idx)
+
+        if by_query:
+            try:
+                resp = await self._es.transport.perform_request(**self._create_delete_by_query_request(**kwargs))
+                return self._delete_by_query_result(resp, progress)
+            except TransportError as e:
+                if not self._delete_by_query_unsupported(e):
+                    raise
+
+                logger.debug('_delete_by_query not available (%s). Deleting with a scroll' % e)
+                kwargs = {}
+
+        kwargs['size'] = self.bulk_chunk_size
+        kwargs['_source'] = False
+
+        deleted = 0
+        errors = []
+        chunk = 0
+        async for results in self._iter_pages(**kwargs):
+            actions = self._delete_hit_actions(results)
+            success, failed = await bulk(self._es, actions, chunk_size=self.bulk_chunk_size, raise_on_error=False,
+                                         thread_count=parallel or self.bulk_thread_count)
+
+            deleted += success
+            summary = self._delete_chunk_summary(chunk, actions, success, failed)
+            if summary['errors']:
+                errors.append(summary)
+
+            if progress:
+                progress(deleted, summary)
+
+            chunk += 1
+
+        return deleted, errors
+
+    async def delete_in(self, ids, parallel=None):
+        if not isinstance(ids, list):
+            raise TypeError('argument to delete in must be a list.')
+
+        written = set()
+        try:
+            return await bulk(self._es, self._delete_actions(ids, written), chunk_size=self.bulk_chunk_size,
+                              thread_count=parallel or self.bulk_thread_count)
+        finally:
+            cache.invalidate(written)
+
+    async def commit(self, callback=None, items=None, **kwargs):
+        """
+        Async version of VWCollection.commit(). ``items`` may also be an async
+        iterable (such as another collection's iter_all())
+        """
+        if callback:
+            if not callable(callback):
+                raise TypeError('Argument 2 to commit() must be callable')
+
+        on_error = kwargs.pop('on_error', None)
+        raise_on_error = kwargs.pop('raise_on_error', False)
+        chunk_size = kwargs.pop('chunk_size', self.bulk_chunk_size)
+        max_chunk_bytes = kwargs.pop('max_chunk_bytes', self.bulk_max_chunk_bytes)
+        thread_count = kwargs.pop('parallel', None) or self.bulk_thread_count
+
+        if items is None:
+            items = self._items or self.iter_all(size=chunk_size)
+
+        success = 0
+        errors = []
+        written = set()
+        actions = self._async_index_actions(items, callback, written)
+        try:
+            async for ok, item in streaming_bulk(self._es, actions, chunk_size=chunk_size,
+                                                 max_chunk_bytes=max_chunk_bytes, thread_count=thread_count,
+                                                 **kwargs):
+                if ok:
+                    success += 1
+                else:
+                    errors.append(item)
+                    if on_error:
+                        on_error(item)
+        finally:
+            cache.invalidate(written)
+
+        if errors and raise_on_error:
+            raise helpers.BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+
+        return success, errors
+
+    async def _async_index_actions(self, items, callback=None, written=None):
+        async for i in _aiter(items):
+            action = self._index_action(i, callback)
+            if written is not None:
+                written.add(action['_index'])
+
+            yield action
+
+
+class AsyncVWMultiSearch(VWMultiSearch):
+    """ VWMultiSearch for AsyncVWCollection. execute() is a coroutine """
+
+    async def execute(self, raise_on_error=False, **kwargs):
+        if not self._searches:
+            return []
+
+        es = self._searches[0][0]._es
+        resp = await es.msearch(body=self._create_msearch_body(), **kwargs)
+
+        results = []
+        for position, response in enumerate(resp['responses']):
+            error = self._response_error(position, response, raise_on_error)
+            results.append(error or await self._searches[position][0]._create_results(response))
+
+        return results
+
+
+class AsyncVWSnapshot(VWSnapshot):
+    """ VWSnapshot for AsyncVWCollection. Use with ``async with`` and ``async for`` """
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.close()
+
+    async def __aiter__(self):
+        while True:
+            page = await self.next_page()
+            if not page:
+                break
+
+            for obj in page:
+                yield obj
+
+    async def open(self):
+        if self._params is not None:
+            return self
+
+        es = self.collection._es
+        try:
+            resp = await es.transport.perform_request(**self._create_open_params())
+            self.pit_id = resp['id']
+            self._params = self._create_pit_params()
+        except TransportError as e:
+            if isinstance(e, ESConnectionError):
+                raise
+
+            logger.debug('Point in time not available (%s). Using scroll' % e)
+            self._params = self._create_scroll_params()
+            self._pending = await es.search(**self._params)
+            self.scroll_id = self._pending.get('_scroll_id')
+
+        return self
+
+    async def next_page(self):
+        await self.open()
+        if self.exhausted:
+            return None
+
+        if self.pit_id:
+            results = await self.collection._es.search(**self._create_search_params())
+        elif self._pending is not None:
+            results, self._pending = self._pending, None
+        else:
+            results = await self.collection._es.scroll(scroll_id=self.scroll_id, scroll=self.keep_alive)
+
+        if not self._read_page(results):
+            return None
+
+        return await self.collection._create_results(results, cls=Page, page=self.page, per_page=self.per_page)
+
+    async def close(self):
+        es = self.collection._es
+        try:
+            if self.pit_id:
+                await es.transport.perform_request('DELETE', '/_pit', body={'id': self.pit_id})
+            elif self.scroll_id:
+                await es.clear_scroll(scroll_id=self.scroll_id)
+        except TransportError:
+            logger.debug('Failed to close snapshot %s' % (self.pit_id or self.scroll_id))
+
+        self.pit_id = None
+        self.scroll_id = None
+        self.exhausted = True
@@ -1,22 +1,32 @@
 from __future__ import absolute_import, unicode_literals
-from six import iteritems, string_types
+from six import iteritems, string_types, add_metaclass
 from past.builtins import unicode
 
 import types
 import copy
+import logging
+from fnmatch import fnmatch
 from datetime import date, datetime
 from uuid import uuid4
 import json
 
-from elasticsearch import Elasticsearch, NotFoundError, helpers, client
+from elasticsearch import NotFoundError, TransportError, ConflictError, helpers, client
+from elasticsearch import VERSION as ES_VERSION
+from elasticsearch import ConnectionError as ESConnectionError
+from elasticsearch.client.utils import _escape
 
-from . import config, querybuilder, qdsl, identity
+from . import config, querybuilder, qdsl, identity, connection, bulk, cache, session
 from .config import logger
 from .util import unset, all_subclasses
-from .relationship import relationship
+from .relationship import relationship, load
 from .es_types import *  # implements elastic search types
 
 
+# internal attributes that can always be set on a model
+_always_set = frozenset(['_set_by_query', '_deleted', '_watch', '_new', '_no_ex', '_pickling', '_document',
+                         '_callbacks'])
+
+
 class ObjectDeletedError(Exception):
     pass
 
@@ -26,6 +36,27 @@ class NoResultsFound(Exception):
     pass
 
 
+# Raised when reading a field left out by only() / defer() with on_access='raise' (or committing the model)
+class DeferredFieldError(AttributeError):
+    pass
+
+
+# Raised by commit() when the document changed since the model was read (see check_version)
+class VersionConflictError(ConflictError):
+    def __init__(self, model, status_code, error, info=None):
+        super(VersionConflictError, self).__init__(status_code, error, info)
+        self.model = model
+
+
+# A query in VWMultiSearch that failed
+class MultiSearchError(Exception):
+    def __init__(self, position, status, error):
+        super(MultiSearchError, self).__init__('Query %i failed (%s): %s' % (position, status, error))
+        self.position = position
+        self.status = status
+        self.error = error
+
+
 # Implements callbacks across objects
 class VWCallback(object):
     _callbacks = {}
@@ -54,6 +85,10 @@ class VWCallback(object):
         except KeyError:
             pass
 
+    @classmethod
+    def has_callbacks(cls, cbtype):
+        return bool(cls._callbacks.get(cls.__name__, {}).get(cbtype))
+
     def execute_callbacks(self, cbtype, argument=None, **kwargs):
         try:
             for cb in self._callbacks[self.__class__.__name__][cbtype]:
@@ -74,12 +109,119 @@ class VWCallback(object):
         return argument
 
 
+class VWSchema(object):
+    """
+    Describes the attributes of a model class. Built once when the class is
+    created (and again if attributes are set on the class) so instances don't
+    have to search the class for them.
+    """
+
+    def __init__(self, cls):
+        # every attribute name on the class
+        self.names = frozenset(dir(cls))
+
+        fields = []
+        computed = []
+        self.defaults = {}
+        self.templates = {}  # defaults converted to ESTypes
+        self.es_args = {}  # es_args() of the templates
+        self.analyzed = {}
+        es_fields = []
+        relationships = []
+        date_fields = []
+
+        for k in sorted(self.names):
+            if k[0] == '_':
+                continue
+
+            v = getattr(cls, k)
+            if isinstance(v, property):
+                computed.append(k)
+                continue
+
+            if isinstance(v, (types.FunctionType, types.MethodType)):
+                continue
+
+            fields.append(k)
+            self.defaults[k] = v
+            self.templates[k] = create_es_type(v)
+            try:
+                if type(self.templates[k]).__class__ == ESType:
+                    self.es_args[k] = self.templates[k].es_args()
+            except AttributeError:
+                pass
+            self.analyzed[k] = is_analyzed(v)
+
+            if isinstance(v, relationship):
+                relationships.append(k)
+
+            if isinstance(self.templates[k], (DateTime, Date)):
+                date_fields.append(k)
+
+            try:
+                if type(v).__class__ == ESType:
+                    es_fields.append(k)
+            except AttributeError:
+                pass
+
+        self.fields = tuple(fields)  # attributes stored in the document
+        self.computed = tuple(computed)  # properties. Their values are copied to the document on __init__()
+        self.es_fields = frozenset(es_fields)  # attributes explicitly defined as ESTypes
+        self.relationships = frozenset(relationships)
+
+        # field => relationships that use it as a key. Setting the field drops preloaded values
+        self.relation_keys = {}
+        for k in relationships:
+            for key in self.defaults[k].params:
+                self.relation_keys.setdefault(key, []).append(k)
+        self.date_fields = frozenset(date_fields)  # string values are returned as dates
+
+        # what __init__() sets (same order as dir())
+        self.init_names = tuple(sorted(fields + computed))
+
+
+class VWMeta(type):
+    # builds VWSchema for each model class
+    def __init__(cls, clsname, bases, dct):
+        super(VWMeta, cls).__init__(clsname, bases, dct)
+        type.__setattr__(cls, '__schema__', VWSchema(cls))
+
+    def _rebuild_schema(cls):
+        type.__setattr__(cls, '__schema__', VWSchema(cls))
+        for sc in all_subclasses(cls):
+            type.__setattr__(sc, '__schema__', VWSchema(sc))
+
+    def __setattr__(cls, name, value):
+        super(VWMeta, cls).__setattr__(name, value)
+        cls._rebuild_schema()
+
+    def __delattr__(cls, name):
+        super(VWMeta, cls).__delattr__(name)
+        cls._rebuild_schema()
+
+
+@add_metaclass(VWMeta)
 class VWBase(identity.VWIdentity, VWCallback):
     # connects to ES
     _watch = False
     _needs_update = False
+    _track = False  # record the fields that change in _dirty
+    _lazy = frozenset()  # fields in the document that haven't been converted yet
     id = ''
     __index__ = None
+    __connection__ = None  # name of a connection in velociwrapper.connection
+    __check_version__ = False  # default for commit(check_version=)
+
+    # version of the document when it was read or last committed
+    _version = None
+    _seq_no = None
+    _primary_term = None
+
+    # shared client from the connection registry. Not stored on the instance
+    # so models never hold a client from before a fork
+    @property
+    def _es(self):
+        return connection.get_connection(self.__connection__)
 
     def __init__(self, **kwargs):
         # the internal document
@@ -101,26 +243,19 @@ class VWBase(identity.VWIdentity, VWCallback):
 
         self._needs_update = False
         self._watch = True
-
-        # connect using defaults or override with kwargs
-        self._es = Elasticsearch(config.dsn, **config.connection_params)
         self._deleted = False
 
         if self.__index__ is None:
             self.__index__ = config.default_index
 
-        for k in dir(self):
-            v = getattr(self, k)
-            # skip functions and special variables
-            if not isinstance(v, types.MethodType) and not k[0] == '_':
-
-                # check if we were called with a variable. If so set
-                try:
-                    v = kwargs[k]
-                except KeyError:
-                    pass
+        for k in type(self).__schema__.init_names:
+            # check if we were called with a variable. If so set
+            try:
+                v = kwargs[k]
+            except KeyError:
+                v = getattr(self, k)
 
-                setattr(self, k, v)
+            setattr(self, k, v)
 
         if 'id' not in kwargs:
             self.id = str(uuid4())
@@ -128,9 +263,157 @@ class VWBase(identity.VWIdentity, VWCallback):
         # make sure we're ready for changes
         self._set_by_query = False
         self._no_ex = False
+        self._reset_changes()
+        object.__setattr__(self, '_track', True)
         if self._new:
             self.execute_callbacks('after_manual_create_model')
 
+    @classmethod
+    def _create_from_query(cls, src, deferred=None, deferred_mode='load'):
+        """
+        Creates a model from a source document returned by Elasticsearch.
+
+        Faster than __init__(). The source document becomes the internal
+        document and values are converted to their types the first time they
+        are read. Only attributes missing from the source (defaults) and
+        relationships are set when the model is created.
+
+        deferred are fields left out of the source by only() / defer(). They
+        are loaded (or raise DeferredFieldError) when read.
+        """
+        # models with their own __init__ must go through it
+        if cls.__init__ is not VWBase.__init__:
+            kwargs = dict(src)
+            kwargs['_set_by_query'] = True
+            obj = cls(**kwargs)
+            if deferred:
+                for k in deferred:
+                    obj._document.pop(k, None)
+
+                obj.__set_deferred(deferred, deferred_mode)
+
+            return obj
+
+        obj = cls.__new__(cls)
+        object.__setattr__(obj, '_document', src)
+        object.__setattr__(obj, '_pickling', False)
+        object.__setattr__(obj, '_no_ex', True)
+        object.__setattr__(obj, '_new', False)
+        object.__setattr__(obj, '_set_by_query', True)
+        object.__setattr__(obj, '_needs_update', False)
+        object.__setattr__(obj, '_watch', False)
+        object.__setattr__(obj, '_deleted', False)
+
+        if deferred:
+            obj.__set_deferred(deferred, deferred_mode)
+
+        schema = cls.__schema__
+        lazy = set()
+        for k in schema.fields:
+            if k not in src:
+                if not deferred or k not in deferred:
+                    setattr(obj, k, getattr(obj, k))
+            elif k in schema.relationships:
+                setattr(obj, k, src[k])
+            else:
+                lazy.add(k)
+
+        object.__setattr__(obj, '_lazy', lazy)
+        object.__setattr__(obj, '_needs_update', False)
+        object.__setattr__(obj, '_watch', True)
+        object.__setattr__(obj, '_set_by_query', False)
+        object.__setattr__(obj, '_no_ex', False)
+        obj._reset_changes()
+        object.__setattr__(obj, '_track', True)
+        return obj
+
+    def __set_deferred(self, deferred, mode):
+        object.__setattr__(self, '_deferred', set(deferred))
+        object.__setattr__(self, '_deferred_mode', mode)
+
+    def undefer(self):
+        """ Loads the fields left out by only() / defer() with one request """
+        deferred = self.__dict__.get('_deferred')
+        if not deferred:
+            return
+
+        fields = sorted(deferred)
+        try:
+            src = self._es.get(index=self.__index__, doc_type=self.__type__, id=self.id,
+                               _source=fields).get('_source') or {}
+        except NotFoundError:
+            src = {}
+
+        object.__setattr__(self, '_deferred', set())
+
+        for k in fields:
+            if k in src:
+                self.__set_loaded_value(k, src[k])
+            else:
+                self.__set_loaded_value(k, copy.deepcopy(self.__get_current_value(k)))
+
+    def __load_deferred(self, name):
+        if self._deferred_mode == 'raise':
+            raise DeferredFieldError('%s was not loaded (only() / defer()). Call undefer() to load it' % name)
+
+        self.undefer()
+
+    # partial models are completed (or raise) before they are saved so the missing fields aren't lost
+    def _check_deferred(self):
+        if self.__dict__.get('_deferred'):
+            if self._deferred_mode == 'raise':
+                raise DeferredFieldError('Cannot commit a partial model. Call undefer() first')
+
+            self.undefer()
+
+    def _reset_changes(self):
+        """
+        Forgets the changes to the model. Called when it is loaded or committed.
+        Lists and dicts can be changed in place without setting the field so
+        a copy is taken the first time one is read (see __watch_container())
+        and compared with in _changed_fields(). Fields read before a commit are
+        copied again as they may still be changed through an old reference
+        """
+        containers = self.__dict__.get('_containers') or {}
+        doc = self.__dict__.get('_document') or {}
+        object.__setattr__(self, '_dirty', set())
+        object.__setattr__(self, '_containers', dict(
+            (k, copy.deepcopy(doc[k])) for k in containers if isinstance(doc.get(k), (list, dict))))
+
+    def _changed_fields(self):
+        """ Returns the fields set or changed in place since the model was loaded or committed """
+        changed = set(self.__dict__.get('_dirty', ()))
+        doc = self._document
+        for k, v in iteritems(self.__dict__.get('_containers') or {}):
+            if k not in changed and doc.get(k) != v:
+                changed.add(k)
+
+        return changed
+
+    # lists and dicts are copied the first time they are read so in place changes can be found
+    def __watch_container(self, d, name, v):
+        if isinstance(v, (list, dict)) and d.get('_track'):
+            containers = d.get('_containers')
+            if containers is not None and name not in containers:
+                containers[name] = copy.deepcopy(v)
+
+        return v
+
+    # converts a value from the source document the first time it is read
+    def __load_lazy_value(self, name):
+        self._lazy.discard(name)
+        self.__set_loaded_value(name, self._document[name])
+
+    # sets a value read from Elasticsearch. Not a change to the model
+    def __set_loaded_value(self, name, value):
+        watch = self._watch
+        track = self._track
+        object.__setattr__(self, '_watch', False)
+        object.__setattr__(self, '_track', False)
+        self.__set_document_value(name, value)
+        object.__setattr__(self, '_watch', watch)
+        object.__setattr__(self, '_track', track)
+
     # customizations for pickling
     def __getstate__(self):
         # mark as pickling
@@ -153,27 +436,40 @@ class VWBase(identity.VWIdentity, VWCallback):
         for k, v in iteritems(state):
             setattr(self, k, v)
 
-        # recreate the _es connection (doesn't reset for some reason)
-        self._es = Elasticsearch(config.dsn, **config.connection_params)
-
         self._pickling = False
 
     def __getattribute__(self, name):
-        # ok this is much funky
-        no_ex = False
+        # internal attributes don't live in the document
+        if name[0] == '_':
+            return super(VWBase, self).__getattribute__(name)
+
+        d = super(VWBase, self).__getattribute__('__dict__')
+
+        # dates already decoded from the document
         try:
-            no_ex = super(VWBase, self).__getattribute__('_no_ex')
-        except AttributeError:
+            return d['_decoded'][name]
+        except KeyError:
             pass
 
+        schema = type(self).__schema__
+
+        # left out by only() / defer()
+        deferred = d.get('_deferred')
+        if deferred and name in deferred:
+            self.__load_deferred(name)
+
+        doc = d.get('_document')
+
         v = unset
-        doc = None
-        try:
-            doc = super(VWBase, self).__getattribute__('_document')
-            if name in doc:
-                v = doc.get(name, unset)
-        except AttributeError:
-            pass
+        if doc is not None and name in doc:
+            if name in d.get('_lazy', ()):
+                self.__load_lazy_value(name)
+
+            v = doc[name]
+
+        elif name in schema.names and name not in schema.fields and name not in schema.computed:
+            # methods and anything else that isn't part of the document
+            return super(VWBase, self).__getattribute__(name)
 
         if not v:
             default_v = super(VWBase, self).__getattribute__(name)
@@ -185,32 +481,44 @@ class VWBase(identity.VWIdentity, VWCallback):
             # instance attribute was becoming a reference to the class
             # attribute. Not what we wanted, make a copy
             if doc:
-                if not isinstance(v, types.MethodType) and not name[0] == '_':
+                if not isinstance(v, types.MethodType):
                     v = copy.deepcopy(v)
-                    self._document[name] = v
-                    return self._document[name]
+                    doc[name] = v
+                    return self.__watch_container(d, name, v)
 
         # we want to keep the relationships if set_by_query in the collection
         # so we only execute with direct access
         # (we'll see, it might have an unintended side-effect)
         # Relationships are not documented and really haven't been tested!
-        if isinstance(v, relationship) and not no_ex:
-            return v.execute(self)
+        if isinstance(v, relationship):
+            if d.get('_no_ex'):
+                return v
 
-        elif isinstance(v, string_types):
+            # loaded with the rest of the results by load()
+            try:
+                return d['_preloaded'][name]
+            except KeyError:
+                return v.execute(self)
+
+        # only fields defined as dates are converted. The result is kept until the field is set again
+        elif isinstance(v, string_types) and name in schema.date_fields:
             try:
                 try:
-                    return datetime.strptime(v, '%Y-%m-%dT%H:%M:%S')
+                    decoded = datetime.strptime(v, '%Y-%m-%dT%H:%M:%S')
                 except ValueError:
-                    return datetime.strptime(v, '%Y-%m-%d').date()
+                    decoded = datetime.strptime(v, '%Y-%m-%d').date()
             except (ValueError, AttributeError, TypeError):
                 return v
+
+            d.setdefault('_decoded', {})[name] = decoded
+            return decoded
         else:
-            return v
+            return self.__watch_container(d, name, v)
 
     # EXPERIMENTAL
     def __set_relationship_value(self, name, value):
         curr_value = self.__get_current_value(name)
+        self.__dict__.get('_preloaded', {}).pop(name, None)
 
         # TODO ... this stuff is probably going to have to be rethought
         currparams = curr_value.get_relational_params(self)
@@ -275,11 +583,41 @@ class VWBase(identity.VWIdentity, VWCallback):
         if name[0] == '_':
             # special rules for names with underscores.
             # setting the _ values will not trigger an update.
-            if (name not in dir(self) or name in ['_set_by_query', '_deleted', '_watch', '_new', '_no_ex', '_pickling',
-                                                  '_document', '_callbacks'] or self._pickling):
+            if (name in _always_set or self._pickling or
+                    (name not in type(self).__schema__.names and name not in object.__getattribute__(self, '__dict__'))):
                 object.__setattr__(self, name, value)  # not copied
+
+                if name == '_document':
+                    object.__setattr__(self, '_decoded', {})
+                    self._reset_changes()
+                    self.__dict__.pop('_preloaded', None)
         else:
-            curr_value = create_es_type(self.__get_current_value(name))  # create as an es_type
+            if self._lazy:
+                self._lazy.discard(name)
+
+            instance_dict = object.__getattribute__(self, '__dict__')
+            decoded = instance_dict.get('_decoded')
+            if decoded:
+                decoded.pop(name, None)
+
+            deferred = instance_dict.get('_deferred')
+            if deferred:
+                deferred.discard(name)
+
+            # create as an es_type
+            schema = type(self).__schema__
+
+            preloaded = instance_dict.get('_preloaded')
+            if preloaded and name in schema.relation_keys:
+                for rel_name in schema.relation_keys[name]:
+                    preloaded.pop(rel_name, None)
+
+            es_args = None
+            if name in schema.templates and name not in instance_dict:
+                curr_value = schema.templates[name]
+                es_args = schema.es_args.get(name)
+            else:
+                curr_value = create_es_type(self.__get_current_value(name))
 
             try:
                 if type(value).__class__ == ESType:
@@ -307,11 +645,11 @@ class VWBase(identity.VWIdentity, VWCallback):
                 try:
                     if type(curr_value).__class__ == ESType:
                         cls = curr_value.__class__
-                        params = curr_value.es_args()
+                        params = es_args if es_args is not None else curr_value.es_args()
 
                         # try to set the value as the same class.
                         try:
-                            value = cls(value, **params)
+                            value = cls.with_es_args(value, params)
                         except:
                             # value didn't set. Try set as es_type
                             test_value = create_es_type(value)
@@ -366,8 +704,11 @@ class VWBase(identity.VWIdentity, VWCallback):
                 object.__setattr__(self, '_needs_update', True)
                 object.__setattr__(self, '_watch', False)
 
+            if self._track and not self._pickling:
+                self._dirty.add(name)
+
     def __setattr__(self, name, value):
-        if '_deleted' in dir(self) and self._deleted:
+        if object.__getattribute__(self, '__dict__').get('_deleted'):
             raise ObjectDeletedError
 
         # we need to do some magic if the current value is a relationship
@@ -381,30 +722,196 @@ class VWBase(identity.VWIdentity, VWCallback):
         else:
             self.__set_document_value(name, value)
 
-    def commit(self, **kwargs):
-        # save in the db
+    def commit(self, update=False, check_version=None, **kwargs):
+        """
+        Saves the model. Indexes the whole document unless update is True, which
+        sends an _update with only the fields changed since the model was
+        loaded or committed (new models are upserted). Update accepts
+        retry_on_conflict, script, upsert and scripted_upsert. See
+        _create_update_body()
+
+        With check_version (default __check_version__) the request only
+        succeeds if the document hasn't changed since the model was read and
+        VersionConflictError is raised otherwise. New models are only created
+        if the id doesn't exist.
+        """
+        # Inside a VWSession the model is saved when the session is flushed
+        active = session.current_session()
+        if active is not None and not kwargs and check_version is None:
+            active.add(self)
+            return
+
+        if check_version is None:
+            check_version = self.__check_version__
+
+        identity.discard(self.__index__, self.__type__, self.id)
+        cache.invalidate(self.__index__)
 
-        if self._deleted and hasattr(self, 'id') and self.id:
-            self.execute_callbacks('on_delete')
-            self._es.delete(id=self.id, index=self.__index__, doc_type=self.__type__)
+        try:
+            if self._deleted and hasattr(self, 'id') and self.id:
+                self.execute_callbacks('on_delete')
+                self._es.delete(**self._create_delete_params(check_version))
+            elif update:
+                self._check_deferred()
+                self.execute_callbacks('before_commit')
+                params = self._create_update_params(check_version=check_version, **kwargs)
+                if params is not None:
+                    self._set_version(self._es.update(**params))
+                self._watch = True
+                object.__setattr__(self, '_new', False)
+                self._reset_changes()
+                self.execute_callbacks('after_commit')
+            else:
+                self._check_deferred()
+                self.execute_callbacks('before_commit')
+                self._set_version(self._es.index(**self._create_index_params(check_version, **kwargs)))
+                self._watch = True
+                object.__setattr__(self, '_new', False)
+                self._reset_changes()
+                self.execute_callbacks('after_commit')
+        except ConflictError as e:
+            raise VersionConflictError(self, e.status_code, e.error, e.info)
+
+    def commit_with_retry(self, mutate, retries=3, **kwargs):
+        """
+        Calls mutate(model) and commits with check_version. On a version
+        conflict the model is synced and mutate is called again, up to retries
+        times before VersionConflictError is raised. Returns the model
+        """
+        attempt = 0
+        while True:
+            mutate(self)
+            try:
+                self.commit(check_version=True, **kwargs)
+                return self
+            except VersionConflictError:
+                attempt += 1
+                if attempt > retries:
+                    raise
+
+                self.sync()
+
+    def async_commit(self, **kwargs):
+        """ Coroutine version of commit(). See velociwrapper.aio """
+        from .aio import commit_model
+        return commit_model(self, **kwargs)
+
+    def async_commit_with_retry(self, mutate, retries=3, **kwargs):
+        """ Coroutine version of commit_with_retry(). See velociwrapper.aio """
+        from .aio import commit_with_retry
+        return commit_with_retry(self, mutate, retries, **kwargs)
+
+    def _create_delete_params(self, check_version=False):
+        params = {'id': self.id, 'index': self.__index__, 'doc_type': self.__type__}
+        if check_version:
+            self._add_version_params(params)
+
+        return params
+
+    def _create_index_params(self, check_version=False, **kwargs):
+        kwargs.update({
+            'index': self.__index__,
+            'doc_type': self.__type__,
+            'body': self._document,
+        })
+        if hasattr(self, 'id') and self.id:
+            kwargs['id'] = self.id
+
+        if check_version:
+            if self._new:
+                kwargs['op_type'] = 'create'
+            else:
+                self._add_version_params(kwargs)
+
+        return kwargs
+
+    # if_seq_no / if_primary_term when the cluster returned them (6.7+), otherwise version
+    def _create_version_params(self):
+        if self._seq_no is not None and self._primary_term is not None:
+            return {'if_seq_no': self._seq_no, 'if_primary_term': self._primary_term}
+
+        if self._version is not None:
+            return {'version': self._version}
+
+        # without a version the write would silently overwrite
+        raise ValueError('The version of {0} {1} is not known. Call sync() before committing with check_version'.format(
+            type(self).__name__, self.id))
+
+    def _add_version_params(self, params):
+        version = self._create_version_params()
+        if 'version' in version:
+            params['version'] = version['version']
         else:
-            self.execute_callbacks('before_commit')
-            idx = self.__index__
-            doc_type = self.__type__
+            # older clients have no if_seq_no / if_primary_term arguments. Sent as query parameters instead
+            query = dict(params.get('params') or {})
+            query.update(version)
+            params['params'] = query
 
-            doc = self._document
+        return params
 
-            kwargs.update({
-                'index': idx,
-                'doc_type': doc_type,
-                'body': doc,
-            })
-            if hasattr(self, 'id') and self.id:
-                kwargs['id'] = self.id
+    def _set_version(self, meta):
+        """ Keeps _version, _seq_no and _primary_term from a hit or write response """
+        for k in ('_version', '_seq_no', '_primary_term'):
+            if meta.get(k) is not None:
+                object.__setattr__(self, k, meta[k])
+
+    def _create_update_body(self, script=None, upsert=None, scripted_upsert=False):
+        """
+        Returns the body of an _update request or None if there is nothing to
+        send.
+
+        Without a script the body has the changed fields as a partial doc. New
+        models send their whole document with doc_as_upsert. A script is sent
+        instead of the changed fields (ValueError if fields were changed) with
+        upsert as the document to create when it doesn't exist (the model's
+        document for new models). With scripted_upsert the script also runs
+        on creation.
+        """
+        changed = self._changed_fields()
+        if script is not None:
+            if changed and not self._new:
+                raise ValueError('Cannot commit changed fields with a script: {0}'.format(
+                    ', '.join(sorted(changed))))
+
+            body = {'script': script}
+            if upsert is None and (self._new or scripted_upsert):
+                upsert = self._document if self._new else {}
+
+            if upsert is not None:
+                body['upsert'] = upsert
+
+            if scripted_upsert:
+                body['scripted_upsert'] = True
+
+            return body
+
+        if self._new:
+            return {'doc': self._document, 'doc_as_upsert': True}
+
+        if not changed:
+            return None
 
-            res = self._es.index(**kwargs)
-            self._watch = True
-            self.execute_callbacks('after_commit')
+        return {'doc': dict((k, self._document[k]) for k in changed if k in self._document)}
+
+    def _create_update_params(self, retry_on_conflict=None, script=None, upsert=None, scripted_upsert=False,
+                              check_version=False, **kwargs):
+        body = self._create_update_body(script=script, upsert=upsert, scripted_upsert=scripted_upsert)
+        if body is None:
+            return None
+
+        kwargs.update({
+            'index': self.__index__,
+            'doc_type': self.__type__,
+            'id': self.id,
+            'body': body
+        })
+        if retry_on_conflict is not None:
+            kwargs['retry_on_conflict'] = retry_on_conflict
+
+        if check_version and not self._new:
+            self._add_version_params(kwargs)
+
+        return kwargs
 
     def sync(self):
         if self.id:
@@ -412,6 +919,7 @@ class VWBase(identity.VWIdentity, VWCallback):
                 self.execute_callbacks('before_sync')
                 res = self._es.get(id=self.id, index=self.__index__)
                 self._document = res.get('_source')
+                self._set_version(res)
 
                 self._new = False
                 self.execute_callbacks('after_sync')
@@ -422,6 +930,11 @@ class VWBase(identity.VWIdentity, VWCallback):
         else:
             raise AttributeError('Object is not committed')
 
+    def async_sync(self):
+        """ Coroutine version of sync(). See velociwrapper.aio """
+        from .aio import sync_model
+        return sync_model(self)
+
     def delete(self):
         if self.id:
             self._deleted = True
@@ -446,23 +959,33 @@ class VWBase(identity.VWIdentity, VWCallback):
         @param base_obj: class
         @return: VWCollection
         """
+        return type(self)._create_collection()
+
+    # same as collection() but callable on the class (used by relationships)
+    @classmethod
+    def _create_collection(cls):
         for vwcollection in all_subclasses(VWCollection):
             try:
-                if vwcollection.__model__ is self.__class__:
+                if vwcollection.__model__ is cls and not vwcollection.__async__:
                     return vwcollection()
             except AttributeError:
                 pass
 
-        return VWCollection(base_obj=self.__class__)
+        return VWCollection(base_obj=cls)
 
 
 # setup the collections
 class VWCollection(VWCallback):
     __model__ = None
+    __connection__ = None  # defaults to the connection of the model
+    __async__ = False  # True for collections in velociwrapper.aio
+    __cache__ = None  # cache.ResultCache for all() and count()
 
     def __init__(self, items=None, **kwargs):
         self._items = items or []  # special list of items that can be committed in bulk
         self.bulk_chunk_size = kwargs.get('bulk_chunk_size', config.bulk_chunk_size)
+        self.bulk_max_chunk_bytes = kwargs.get('bulk_max_chunk_bytes', config.bulk_max_chunk_bytes)
+        self.bulk_thread_count = kwargs.get('bulk_thread_count', config.bulk_thread_count)
         self.results_per_page = kwargs.get('results_per_page', config.results_per_page)
         self.base_obj = kwargs.get('base_obj', self.__class__.__model__)
         if self.base_obj is None:
@@ -470,12 +993,27 @@ class VWCollection(VWCallback):
 
         self.type = self.base_obj.__type__
         self.idx = getattr(self.base_obj, '__index__', config.default_index)
-        self._es = Elasticsearch(config.dsn, **config.connection_params)
-        self._esc = client.IndicesClient(self._es)
+        self.connection = kwargs.get('connection', self.__class__.__connection__)
+        if self.connection is None:
+            self.connection = getattr(self.base_obj, '__connection__', None)
+        self.cache = kwargs.get('cache', self.__class__.__cache__)
         self._sort = []
         self._raw = {}
         self._special_body = {}
         self._querybody = querybuilder.QueryBody()  # sets up the new query bodies
+        self._options = []
+        self._source_includes = []
+        self._source_excludes = []
+        self._docvalue_fields = []
+        self._deferred_mode = 'load'
+
+    @property
+    def _es(self):
+        return connection.get_connection(self.connection)
+
+    @property
+    def _esc(self):
+        return client.IndicesClient(self._es)
 
     def search(self, query, **kwargs):
         self._querybody.chain(qdsl.query_string(query, **kwargs), type='query')
@@ -530,8 +1068,8 @@ class VWCollection(VWCallback):
                 self._querybody.chain(qdsl.ids(id_filter), condition=condition)
             else:
                 try:
-                    analyzed = is_analyzed(getattr(self.base_obj, k))
-                except AttributeError:
+                    analyzed = self.base_obj.__schema__.analyzed[k]
+                except KeyError:
                     analyzed = is_analyzed(v)
 
                 q_type = 'filter'
@@ -573,17 +1111,15 @@ class VWCollection(VWCallback):
     def exact(self, field, value, **kwargs):
         kwargs = self._check_datetime_dict(kwargs)
         try:
-            field_template = getattr(self.base_obj, field)
-
-            if type(field_template) != ESType:
-                field_template = create_es_type(field_template)
+            # already converted to an ESType by the schema
+            field_template = self.base_obj.__schema__.templates[field]
 
             for estype in [String, IP, Attachment]:
                 if isinstance(field_template, estype) and field_template.analyzed == True:
                     logger.warn('%s types may not exact match correctly if they are analyzed' % unicode(
                         estype.__class__.__name__))
 
-        except AttributeError:
+        except (AttributeError, KeyError):
             logger.warn('%s is not in the base model.' % unicode(field))
 
         kwargs['type'] = 'filter'
@@ -601,12 +1137,14 @@ class VWCollection(VWCallback):
         return ' AND '.join(args)
 
     def get(self, id, **kwargs):
+        identity_map, known, missing = self._identity_split([id], kwargs)
+        if known:
+            return known[self._get_many_key(id)]
+
         try:
-            params = {'index': self.idx, 'doc_type': self.type, 'id': id}
-            params.update(kwargs)
-            doc = self._es.get(**params)
+            doc = self._es.get(**self._create_get_params(id, **kwargs))
             if doc:
-                return VWCollectionGen(self.base_obj, {'docs': [doc]})[0]
+                return self._create_identity_results(identity_map, [id], known, {'docs': [doc]})[0]
 
             return None
 
@@ -614,23 +1152,167 @@ class VWCollection(VWCallback):
             # TODO. Discuss this. Should get() return None even on exceptions?
             return None
 
+    def _create_get_params(self, id, **kwargs):
+        params = {'index': self.idx, 'doc_type': self.type, 'id': id}
+        params.update(kwargs)
+        return params
+
     def refresh(self, **kwargs):
         self._esc.refresh(index=self.idx, **kwargs)
 
     def get_in(self, ids, **kwargs):
-        if len(ids) > 0:  # check for ids. empty list returns an empty list (instead of exception)
-            # filter any Nones in the list as they crash the client
-            ids = [_id for _id in ids if _id != None]
-            if len(ids) < 1:
-                return []
-
-            params = {'index': self.idx, 'doc_type': self.type, 'body': {'ids': ids}}
-            params.update(kwargs)
+        identity_map, known, missing = self._identity_split(ids, kwargs)
+
+        res = None
+        params = self._create_mget_params(missing, **kwargs)
+        if params:
             res = self._es.mget(**params)
-            if res and res.get('docs'):
-                return VWCollectionGen(self.base_obj, res)
 
-        return []
+        return self._create_identity_results(identity_map, ids, known, res)
+
+    def get_many(self, ids, chunk_size=None, parallel=None, as_dict=False, **kwargs):
+        """
+        Gets any number of documents by id with mget requests of chunk_size ids
+        (config.mget_chunk_size), parallel at a time (config.bulk_thread_count).
+
+        Returns a list of models in the order of ids with None for the ids that
+        weren't found or, with as_dict, a dict of id => model (or None). Ids
+        already in the active IdentityMap aren't requested.
+        """
+        identity_map, found, chunks = self._create_get_many_chunks(ids, chunk_size, kwargs)
+        parallel = parallel or config.bulk_thread_count
+
+        def fetch(chunk):
+            return self._es.mget(**self._create_mget_params(chunk, **kwargs))
+
+        if parallel <= 1 or len(chunks) <= 1:
+            responses = (fetch(chunk) for chunk in chunks)
+            self._add_get_many_results(identity_map, found, chunks, responses)
+        else:
+            # Avoid importing multiprocessing unless needed (same as bulk)
+            from multiprocessing.dummy import Pool
+            pool = Pool(min(parallel, len(chunks)))
+            try:
+                # models are created in this thread as the responses arrive (in order)
+                self._add_get_many_results(identity_map, found, chunks, pool.imap(fetch, chunks))
+            finally:
+                pool.close()
+                pool.join()
+
+        return self._create_get_many_output(ids, found, as_dict)
+
+    # returns the active identity map, the models it has by id and the other ids (once each) in chunks.
+    # Ids are strings (the same as _id in the responses) so ids given as numbers are found
+    def _create_get_many_chunks(self, ids, chunk_size, kwargs):
+        ids = [self._get_many_key(_id) for _id in ids]
+        identity_map, known, missing = self._identity_split(ids, kwargs)
+        chunk_size = chunk_size or config.mget_chunk_size
+
+        found = dict(known)
+        unique = []
+        seen = set()
+        for _id in missing:
+            if _id is not None and _id not in seen:
+                seen.add(_id)
+                unique.append(_id)
+
+        return identity_map, found, [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+
+    def _add_get_many_results(self, identity_map, found, chunks, responses):
+        for chunk, res in zip(chunks, responses):
+            self._add_get_many_models(found, self._create_identity_results(identity_map, chunk, {}, res))
+
+    @staticmethod
+    def _add_get_many_models(found, results):
+        if results:
+            for i, doc in enumerate(results.doc_list):
+                if doc.get('found', True) and doc.get('_source') is not None:
+                    found[doc['_id']] = results._get_obj(i)
+
+    @staticmethod
+    def _get_many_key(_id):
+        return None if _id is None else unicode(_id)
+
+    @classmethod
+    def _create_get_many_output(cls, ids, found, as_dict):
+        if as_dict:
+            return dict((_id, found.get(cls._get_many_key(_id))) for _id in ids)
+
+        return [found.get(cls._get_many_key(_id)) for _id in ids]
+
+    def _identity_key(self, id):
+        return identity.key(self.idx, self.type, id)
+
+    # returns the active identity map, the models it already has (by id as a string) and the ids that have to be
+    # fetched. Requests with extra arguments (fields, routing, etc.) don't use the map
+    def _identity_split(self, ids, kwargs):
+        identity_map = identity.current_map()
+        if identity_map is None or kwargs:
+            return None, {}, ids
+
+        known = {}
+        missing = []
+        for _id in ids:
+            obj = identity_map.get(self._identity_key(_id))
+            if obj is not None:
+                known[self._get_many_key(_id)] = obj
+            else:
+                missing.append(_id)
+
+        return identity_map, known, missing
+
+    def _create_identity_results(self, identity_map, ids, known, res):
+        merged = self._merge_identity_results(ids, known, res)
+        if merged is None:
+            return []
+
+        results = self._create_results(*merged)
+        self._add_identity_results(identity_map, known, results)
+        return results
+
+    # merges the models from the identity map with the fetched documents in the order of ids.
+    # Returns the results and the models for VWCollectionGen or None if there is nothing
+    def _merge_identity_results(self, ids, known, res):
+        if not known:
+            if not res or not res.get('docs'):
+                return None
+
+            return res, None
+
+        fetched = iter((res.get('docs') or []) if res else [])
+        docs = []
+        objects = []
+        for _id in ids:
+            if _id is None:
+                continue
+
+            key = self._get_many_key(_id)
+            if key in known:
+                docs.append({'_index': self.idx, '_type': self.type, '_id': key, 'found': True,
+                             '_source': known[key]._document})
+                objects.append(known[key])
+            else:
+                docs.append(next(fetched))
+                objects.append(None)
+
+        return {'docs': docs}, objects
+
+    def _add_identity_results(self, identity_map, known, results):
+        if identity_map is not None:
+            for i, doc in enumerate(results.doc_list):
+                if doc.get('_source') and doc['_id'] not in known:
+                    identity_map.add(self._identity_key(doc['_id']), results._get_obj(i))
+
+    # returns None if there are no ids to get
+    def _create_mget_params(self, ids, **kwargs):
+        # filter any Nones in the list as they crash the client
+        ids = [_id for _id in ids if _id != None]
+        if len(ids) < 1:  # empty list returns an empty list (instead of exception)
+            return None
+
+        params = {'index': self.idx, 'doc_type': self.type, 'body': {'ids': ids}}
+        params.update(kwargs)
+        return params
 
     def get_like_this(self, doc_id, **kwargs):
         params = {'index': self.idx, 'doc_type': self.type, 'id': doc_id}
@@ -671,17 +1353,46 @@ class VWCollection(VWCallback):
             q['body'] = qdsl.query(qdsl.match_all())
 
         # after_query_build() can manipulate the final query before being sent to ES
-        # this is generally considered a bad idea but might be useful for logging
-        q = self.execute_callbacks('after_query_build', q)
-
-        logger.debug(json.dumps(q))
+        # this is generally considered a bad idea but might be useful for logging.
+        # The built body is kept for the next request so callbacks get a copy
+        if self.has_callbacks('after_query_build'):
+            q['body'] = copy.deepcopy(q['body'])
+            q = self.execute_callbacks('after_query_build', q)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(q))
         return q
 
     def count(self):
         params = self._create_search_params()
-        resp = self._es.count(**params)
+        resp = self._cached_request('count', params)
         return resp.get('count')
 
+    # sends the request or returns the cached result when the collection has a cache
+    def _cached_request(self, op, params):
+        key, results = self._cache_lookup(op, params)
+        if results is None:
+            results = getattr(self._es, op)(**params)
+            self._cache_store(key, params, results)
+
+        return results
+
+    def _cache_lookup(self, op, params):
+        if self.cache is None:
+            return None, None
+
+        key = cache.cache_key(op, params)
+        value = self.cache.get(key)
+        if value is None:
+            return key, None
+
+        # a new copy each time so results can't be changed in the cache
+        return key, json.loads(value)
+
+    def _cache_store(self, key, params, results):
+        if key is not None:
+            self.cache.set(key, json.dumps(results), cache.index_names(params.get('index')))
+
     def __len__(self):
         return self.count()
 
@@ -689,8 +1400,14 @@ class VWCollection(VWCallback):
         self.results_per_page = count
         return self
 
-    def all(self, **kwargs):
+    # hits only have a version when asked for. Models need it to be committed with check_version
+    @staticmethod
+    def _add_hit_version_params(params):
+        params.setdefault('version', True)
+        if ES_VERSION >= (7, 0, 0):
+            params.setdefault('seq_no_primary_term', True)
 
+    def _create_page_params(self, source_fields=None, **kwargs):
         params = self._create_search_params()
         if not params.get('size'):
             params['size'] = self.results_per_page
@@ -703,25 +1420,325 @@ class VWCollection(VWCallback):
             kwargs['from_'] = kwargs.get('start')
             del kwargs['start']
 
-        logger.debug(json.dumps(self._sort))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(self._sort))
 
         params.update(kwargs)
-        if len(self._sort) > 0:
-            if params.get('sort') and isinstance(params['sort'], list):
-                params['sort'].extend(self._sort)
+        sort = self._create_sort_list(params)
+        if sort:
+            params['sort'] = ','.join(sort)
+
+        self._add_hit_version_params(params)
+
+        return self._add_source_params(params, source_fields)
+
+    # merges sort() with a "sort" argument. Returns a list of "field:direction"
+    def _create_sort_list(self, params):
+        sort = params.get('sort') or []
+        if not isinstance(sort, list):
+            raise TypeError('"sort" argument must be a list')
+
+        return list(sort) + self._sort
+
+    # converts "field:direction" sorts to the request body format
+    def _sort_to_body(self, sort):
+        body_sort = []
+        for s in sort:
+            field, _, direction = s.partition(':')
+            body_sort.append({field: {'order': direction or 'asc'}})
+
+        return body_sort
+
+    def all(self, as_dict=False, **kwargs):
+        if as_dict:
+            return self.values(**kwargs)
+
+        params = self._create_page_params(**kwargs)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(params))
+        results = self._cached_request('search', params)
+
+        return self._create_results(results)
+
+    def values(self, *fields, **kwargs):
+        """
+        Same as all() but returns a list of the _source dicts (with "id") or,
+        if fields are given, tuples of those fields. No models are created
+        and callbacks are not run. Only the fields are requested from the
+        _source
+        """
+        params = self._create_page_params(source_fields=fields, **kwargs)
+        results = self._cached_request('search', params)
+        return list(self._raw_results(results, fields))
+
+    # yields the _source (or tuples of fields) of each hit
+    def _raw_results(self, results, fields=None):
+        for hit in results['hits']['hits']:
+            src = hit.get('_source') or {}
+            src['id'] = hit.get('_id')
+            if fields:
+                yield tuple(_get_path(src, f) for f in fields)
             else:
-                params['sort'] = self._sort
+                yield src
+
+    def _create_gen(self, results, objects=None, cls=None, **kwargs):
+        gen = (cls or VWCollectionGen)(self.base_obj, results, **kwargs)
+        if objects is not None:
+            gen._objects = objects
+
+        # search hits are filtered by only() / defer(). get() and get_in() ("docs") always have the whole _source
+        if 'hits' in results:
+            gen._deferred = self._deferred_fields()
+            gen._deferred_mode = self._deferred_mode
+
+        return gen
+
+    # chainable
+    def only(self, *fields, **kwargs):
+        """
+        Only loads the fields from the _source (wildcards allowed). Other
+        fields are loaded with a get request when read or, with
+        on_access='raise', raise DeferredFieldError
+        """
+        self._source_includes.extend(fields)
+        self._deferred_mode = kwargs.get('on_access', self._deferred_mode)
+        return self
+
+    # chainable
+    def defer(self, *fields, **kwargs):
+        """ Leaves the fields out of the _source. The opposite of only() """
+        self._source_excludes.extend(fields)
+        self._deferred_mode = kwargs.get('on_access', self._deferred_mode)
+        return self
+
+    # chainable
+    def docvalues(self, *fields):
+        """ Requests docvalue_fields (Elasticsearch 5.x+). Values are used for fields missing from the _source """
+        self._docvalue_fields.extend(fields)
+        return self
+
+    # adds the source filtering to search parameters. source_fields are the fields needed by values() / iter_raw()
+    def _add_source_params(self, params, source_fields=None):
+        if not (self._source_includes or self._source_excludes or self._docvalue_fields or source_fields):
+            return params
+
+        # copy so the built query isn't changed
+        params['body'] = dict(params['body'])
+        if source_fields and not self._source_includes:
+            # id comes from _id
+            params['body']['_source'] = {'includes': [f for f in source_fields if f != 'id']} if any(
+                f != 'id' for f in source_fields) else False
+        elif self._source_includes or self._source_excludes:
+            source = {}
+            if self._source_includes:
+                source['includes'] = list(self._source_includes)
+            if self._source_excludes:
+                source['excludes'] = list(self._source_excludes)
+            params['body']['_source'] = source
+
+        if self._docvalue_fields:
+            params['body']['docvalue_fields'] = list(self._docvalue_fields)
+
+        return params
+
+    # fields of the model that only() / defer() leave out (or only partly load)
+    def _deferred_fields(self):
+        if not (self._source_includes or self._source_excludes):
+            return None
+
+        schema = self.base_obj.__schema__
+        deferred = set()
+        for k in schema.fields:
+            if k == 'id' or k in schema.relationships:
+                continue
+
+            if self._source_includes and not any(fnmatch(k, p) for p in self._source_includes):
+                # included only in part ("meta.title")
+                deferred.add(k)
+            elif any(fnmatch(k, p) or p.startswith(k + '.') for p in self._source_excludes):
+                deferred.add(k)
+
+        return frozenset(deferred)
+
+    # chainable
+    def options(self, *options):
+        """ Adds loader options such as load('relationship') to the results """
+        self._options.extend(options)
+        return self
+
+    def paginate(self, page=1, per_page=None, track_total_hits=None, **kwargs):
+        """
+        Returns a Page of results with the total number of matches from the same
+        search (no count request).
+
+        track_total_hits counts matches up to that number only (Elasticsearch
+        5.x+ body option; 7.x+ responds with the relation). The Page's
+        total_relation is "gte" when the total is a lower bound
+        """
+        page, per_page, params = self._create_paginate_params(page, per_page, track_total_hits, **kwargs)
+        results = self._cached_request('search', params)
+        return self._create_results(results, cls=Page, page=page, per_page=per_page)
+
+    def _create_paginate_params(self, page, per_page, track_total_hits, **kwargs):
+        page = int(page)
+        if page < 1:
+            raise ValueError('page must be 1 or more')
+
+        per_page = per_page or self.results_per_page
+        kwargs['size'] = per_page
+        kwargs['from_'] = (page - 1) * per_page
+        params = self._create_page_params(**kwargs)
+
+        if track_total_hits is not None:
+            # copy so the built query isn't changed
+            params['body'] = dict(params['body'])
+            params['body']['track_total_hits'] = track_total_hits
+
+        return page, per_page, params
+
+    # returns the header and body for the search in a multi search request
+    def _create_msearch_params(self, **kwargs):
+        params = self._create_page_params(**kwargs)
+
+        header = {'index': params.pop('index')}
+        if params.get('doc_type'):
+            header['type'] = params.pop('doc_type')
 
+        # copy so the built query isn't changed
+        body = dict(params.pop('body'))
         if params.get('sort'):
-            if isinstance(params['sort'], list):
-                params['sort'] = ','.join(params.get('sort'))
-            else:
-                raise TypeError('"sort" argument must be a list')
+            body['sort'] = self._sort_to_body(params.pop('sort').split(','))
+
+        if 'from_' in params:
+            body['from'] = params.pop('from_')
+
+        # anything else (size, _source, etc.) is valid in the body as is
+        for k, v in iteritems(params):
+            if v is not None:
+                body[k] = v
+
+        return header, body
+
+    # wraps results in VWCollectionGen (or cls) and applies options(). objects are models already created for the
+    # results
+    def _create_results(self, results, objects=None, cls=None, **kwargs):
+        gen = self._create_gen(results, objects, cls, **kwargs)
+
+        if self._options:
+            models = gen._models()
+            for option in self._options:
+                option.apply(self.base_obj, models)
+
+        return gen
+
+    def _create_stream_params(self, scroll='5m', search_after=False, tiebreaker='_uid', source_fields=None, **kwargs):
+        # search parameters for the first page of iter_all()
+        if kwargs.get('results_per_page') != None:
+            kwargs['size'] = kwargs.get('results_per_page')
+            del kwargs['results_per_page']
+
+        params = self._create_search_params()
+        params['size'] = kwargs.pop('size', None) or self.results_per_page
+        params.update(kwargs)
+        self._add_hit_version_params(params)
+        if '_source' not in params:
+            params = self._add_source_params(params, source_fields)
+        sort = self._create_sort_list(params)
+
+        if search_after:
+            params.pop('sort', None)
+            if tiebreaker and tiebreaker not in [s.partition(':')[0] for s in sort]:
+                sort.append('%s:asc' % tiebreaker)
+
+            # copy so the built query isn't changed
+            params['body'] = dict(params['body'])
+            params['body']['sort'] = self._sort_to_body(sort)
+        else:
+            # _doc is the cheapest order when none is given
+            params['sort'] = ','.join(sort or ['_doc'])
+            params['scroll'] = scroll
+
+        return params
+
+    def _iter_pages(self, scroll='5m', search_after=False, tiebreaker='_uid', **kwargs):
+        # yields the raw search results one page at a time. kwargs are passed to _create_stream_params()
+        params = self._create_stream_params(scroll=scroll, search_after=search_after, tiebreaker=tiebreaker,
+                                            **kwargs)
+
+        if search_after:
+            while True:
+                results = self._es.search(**params)
+                hits = results['hits']['hits']
+                if not hits:
+                    break
+
+                yield results
+
+                if len(hits) < params['size']:
+                    break
+
+                params['body']['search_after'] = hits[-1]['sort']
+
+        else:
+            scroll_id = None
+            try:
+                results = self._es.search(**params)
+                while True:
+                    scroll_id = results.get('_scroll_id')
+                    if not results['hits']['hits']:
+                        break
+
+                    yield results
+
+                    results = self._es.scroll(scroll_id=scroll_id, scroll=scroll)
+            finally:
+                if scroll_id:
+                    try:
+                        self._es.clear_scroll(scroll_id=scroll_id)
+                    except TransportError:
+                        logger.debug('Failed to clear scroll %s' % scroll_id)
+
+    def iter_all(self, scroll='5m', search_after=False, tiebreaker='_uid', **kwargs):
+        """
+        Generator that yields every matching model, one page at a time.
+
+        Pages are retrieved with the scroll API (kept alive for ``scroll``). Pass
+        search_after=True to page with search_after instead. The sort is made
+        stable by adding the ``tiebreaker`` field. Closing the generator early
+        clears the scroll.
+        """
+        pages = self._iter_pages(scroll=scroll, search_after=search_after, tiebreaker=tiebreaker, **kwargs)
+        try:
+            for results in pages:
+                for obj in self._create_results(results):
+                    yield obj
+        finally:
+            pages.close()
+
+    stream = iter_all
 
-        logger.debug(json.dumps(params))
-        results = self._es.search(**params)
+    def iter_raw(self, *fields, **kwargs):
+        """
+        Same as iter_all() but yields the _source dicts (with "id") or tuples
+        of fields instead of models. See values()
+        """
+        pages = self._iter_pages(source_fields=fields, **kwargs)
+        try:
+            for results in pages:
+                for row in self._raw_results(results, fields):
+                    yield row
+        finally:
+            pages.close()
 
-        return VWCollectionGen(self.base_obj, results)
+    def snapshot(self, keep_alive='5m', per_page=None, tiebreaker='_shard_doc', **kwargs):
+        """
+        Returns a VWSnapshot that pages through the results as they were when
+        it was opened. Use as a context manager so the point in time (or scroll
+        on clusters without point in time) is closed. kwargs are passed to the
+        search
+        """
+        return VWSnapshot(self, keep_alive=keep_alive, per_page=per_page, tiebreaker=tiebreaker, **kwargs)
 
     def one(self, **kwargs):
         kwargs['results_per_page'] = 1
@@ -789,78 +1806,482 @@ class VWCollection(VWCallback):
         self._querybody.chain(qdsl.filter_(qdsl.exists(field, **kwargs)))
         return self
 
-    def delete(self, **kwargs):
-        deletes = self.all(size=self.count(), _source_include=['id']).results()['hits']['hits']
-        ids = [d['_source'].get('id') for d in deletes]
-        return self.delete_in(ids)
+    def delete(self, progress=None, by_query=False, parallel=None, **kwargs):
+        """
+        Deletes every document matched by the search.
 
-    def delete_in(self, ids):
+        Ids are streamed from a scroll and deleted in bulk requests of
+        ``bulk_chunk_size`` as they are read, so memory use does not grow with
+        the number of matches. ``parallel`` requests are sent at once (defaults
+        to ``bulk_thread_count``). ``progress`` is called after each chunk with
+        the number of documents deleted so far and the chunk summary.
+
+        With by_query=True the server's _delete_by_query (Elasticsearch 5.0+)
+        deletes the documents in one request and kwargs are its parameters
+        (conflicts, refresh, etc.). progress is called once. Clusters without
+        it are deleted with the scroll instead.
+
+        Returns a tuple of the number deleted and a list of summaries for the
+        chunks that had errors.
+        """
+        identity.invalidate(self.idx, self.type)
+        cache.invalidate(self.idx)
+
+        if by_query:
+            try:
+                resp = self._es.transport.perform_request(**self._create_delete_by_query_request(**kwargs))
+                return self._delete_by_query_result(resp, progress)
+            except TransportError as e:
+                if not self._delete_by_query_unsupported(e):
+                    raise
+
+                logger.debug('_delete_by_query not available (%s). Deleting with a scroll' % e)
+                kwargs = {}
+
+        kwargs['size'] = self.bulk_chunk_size
+        kwargs['_source'] = False
+
+        deleted = 0
+        errors = []
+        for chunk, results in enumerate(self._iter_pages(**kwargs)):
+            actions = self._delete_hit_actions(results)
+            success, failed = bulk.bulk(self._es, actions, chunk_size=self.bulk_chunk_size, raise_on_error=False,
+                                        thread_count=parallel or self.bulk_thread_count)
+
+            deleted += success
+            summary = self._delete_chunk_summary(chunk, actions, success, failed)
+            if summary['errors']:
+                errors.append(summary)
+
+            if progress:
+                progress(deleted, summary)
+
+        return deleted, errors
+
+    # _delete_by_query is called through the transport because older clients don't have it. The type is a filter
+    # because older clusters read /index/type/_delete_by_query as a document
+    def _create_delete_by_query_request(self, **kwargs):
+        index = self.idx if isinstance(self.idx, string_types) else ','.join(self.idx)
+
+        body = dict(self._create_search_params()['body'])
+        if self.type and isinstance(self.type, string_types):
+            body['query'] = {'bool': {'must': body.get('query') or {'match_all': {}},
+                                      'filter': {'type': {'value': self.type}}}}
+
+        # converted the same way the client methods convert their parameters
+        params = dict((k, v if k in ('ignore', 'request_timeout') else _escape(v)) for k, v in iteritems(kwargs))
+
+        return {'method': 'POST', 'url': '/%s/_delete_by_query' % index, 'params': params, 'body': body}
+
+    @staticmethod
+    def _delete_by_query_unsupported(error):
+        # clusters without the endpoint read _delete_by_query as a type name or have no handler for the url.
+        # Other errors (a missing index, bad parameters) are raised
+        if error.status_code not in (400, 404, 405):
+            return False
+
+        message = ' '.join('%s' % arg for arg in error.args[1:]).lower()  # the error and the response
+        return any(m in message for m in ('invalid_type_name', 'invalidtypename', 'no handler found'))
+
+    @staticmethod
+    def _delete_by_query_result(resp, progress):
+        failures = resp.get('failures') or []
+        summary = {'chunk': 0, 'count': resp.get('total', 0), 'deleted': resp.get('deleted', 0), 'errors': failures}
+        if progress:
+            progress(summary['deleted'], summary)
+
+        return summary['deleted'], [summary] if failures else []
+
+    def _delete_hit_actions(self, results):
+        return [{'_op_type': 'delete', '_type': h.get('_type', self.type), '_index': h.get('_index', self.idx),
+                 '_id': h['_id']} for h in results['hits']['hits']]
+
+    def _delete_chunk_summary(self, chunk, actions, success, failed):
+        # documents already deleted by someone else are not errors
+        failed = [f for f in failed if f.get('delete', {}).get('status') != 404]
+        return {'chunk': chunk, 'count': len(actions), 'deleted': success, 'errors': failed}
+
+    def delete_in(self, ids, parallel=None):
         if not isinstance(ids, list):
             raise TypeError('argument to delete in must be a list.')
 
-        bulk_docs = []
-        for i in ids:
-            this_id = i
-            this_type = self.base_obj.__type__
-            this_idx = self.idx
-            if isinstance(i, VWBase):
-                this_id = i.id
-                this_type = i.__type__
-                try:
-                    this_idx = i.__index__
-                except AttributeError:
-                    pass
+        written = set()
+        try:
+            return bulk.bulk(self._es, self._delete_actions(ids, written), chunk_size=self.bulk_chunk_size,
+                             thread_count=parallel or self.bulk_thread_count)
+        finally:
+            cache.invalidate(written)
 
-            bulk_docs.append({'_op_type': 'delete', '_type': this_type, '_index': this_idx, '_id': this_id})
+    # written collects the indexes the actions change
+    def _delete_actions(self, ids, written=None):
+        for i in ids:
+            action = self._delete_action(i)
+            if written is not None:
+                written.add(action['_index'])
+
+            yield action
+
+    def _delete_action(self, i):
+        this_id = i
+        this_type = self.base_obj.__type__
+        this_idx = self.idx
+        if isinstance(i, VWBase):
+            this_id = i.id
+            this_type = i.__type__
+            try:
+                this_idx = i.__index__
+            except AttributeError:
+                pass
 
-        return helpers.bulk(self._es, bulk_docs, chunk_size=self.bulk_chunk_size)
+        identity.discard(this_idx, this_type, this_id)
+        return {'_op_type': 'delete', '_type': this_type, '_index': this_idx, '_id': this_id}
 
     # commits items in bulk
-    def commit(self, callback=None):
-        bulk_docs = []
-
+    def commit(self, callback=None, items=None, **kwargs):
+        """
+        Bulk indexes models or dicts.
+
+        ``items`` can be any iterable or generator. If not given the items passed
+        to __init__() are used or, if there are none, every document matched by
+        the current search (read with a scroll). An empty ``items`` commits
+        nothing. Items are streamed to the server in chunks of
+        ``bulk_chunk_size`` documents and at most ``bulk_max_chunk_bytes``
+        bytes.
+
+        Returns a tuple of the number of documents indexed and a list of the
+        documents that failed. ``on_error`` is called with each failed document
+        as it is reported. Pass raise_on_error=True to raise BulkIndexError
+        instead.
+
+        ``parallel`` sends that many chunks at once (defaults to
+        ``bulk_thread_count``). Documents rejected by an overloaded cluster are
+        retried with backoff.
+        """
         if callback:
             if not callable(callback):
                 raise TypeError('Argument 2 to commit() must be callable')
 
-        # allow for a search to work if there are not _items
-        if len(self._items) == 0:
-            items = self.all()
-        else:
-            items = self._items
+        on_error = kwargs.pop('on_error', None)
+        raise_on_error = kwargs.pop('raise_on_error', False)
+        chunk_size = kwargs.pop('chunk_size', self.bulk_chunk_size)
+        max_chunk_bytes = kwargs.pop('max_chunk_bytes', self.bulk_max_chunk_bytes)
+        thread_count = kwargs.pop('parallel', None) or self.bulk_thread_count
+
+        # allow for a search to work if there are not _items. An empty items argument commits nothing
+        if items is None:
+            items = self._items or self.iter_all(size=chunk_size)
+
+        success = 0
+        errors = []
+        written = set()
+        try:
+            for ok, item in bulk.streaming_bulk(self._es, self._index_actions(items, callback, written),
+                                                chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+                                                thread_count=thread_count, **kwargs):
+                if ok:
+                    success += 1
+                else:
+                    errors.append(item)
+                    if on_error:
+                        on_error(item)
+        finally:
+            cache.invalidate(written)
+
+        if errors and raise_on_error:
+            raise helpers.BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
 
+        return success, errors
+
+    # written collects the indexes the actions change
+    def _index_actions(self, items, callback=None, written=None):
         for i in items:
-            if callback:
-                i = callback(i)
+            action = self._index_action(i, callback)
+            if written is not None:
+                written.add(action['_index'])
 
-            i = self.execute_callbacks('on_bulk_commit', i)
+            yield action
 
-            if isinstance(i, VWBase):
-                this_dict = i._create_source_document()
-                this_type = i.__type__
-                this_id = i.id
-                try:
-                    this_idx = i.__index__
-                except AttributeError:
-                    this_idx = self.idx
-            elif isinstance(i, dict):
-                this_dict = i
-                this_id = i.get('id')
+    # converts a model or dict to a bulk index action
+    def _index_action(self, i, callback=None):
+        if callback:
+            i = callback(i)
+
+        i = self.execute_callbacks('on_bulk_commit', i)
+
+        if isinstance(i, VWBase):
+            i._check_deferred()
+            this_dict = i._create_source_document()
+            this_type = i.__type__
+            this_id = i.id
+            try:
+                this_idx = i.__index__
+            except AttributeError:
                 this_idx = self.idx
-                this_type = self.type
-            else:
-                raise TypeError('Elements passed to the collection must be type of "dict" or "VWBase"')
+        elif isinstance(i, dict):
+            this_dict = i
+            this_id = i.get('id')
+            this_idx = self.idx
+            this_type = self.type
+        else:
+            raise TypeError('Elements passed to the collection must be type of "dict" or "VWBase"')
+
+        if not this_id:
+            this_id = str(uuid4())
+
+        identity.discard(this_idx, this_type, this_id)
+        return {'_op_type': 'index', '_type': this_type, '_index': this_idx, '_id': this_id, '_source': this_dict}
 
-            if not this_id:
-                this_id = str(uuid4())
 
-            bulk_docs.append(
-                {'_op_type': 'index', '_type': this_type, '_index': this_idx, '_id': this_id, '_source': this_dict})
+# returns the value of a field or "object.field" path from a source document
+def _get_path(src, path):
+    value = src.get(path)
+    if value is None and '.' in path:
+        value = src
+        for part in path.split('.'):
+            if not isinstance(value, dict):
+                return None
 
-        return helpers.bulk(self._es, bulk_docs, chunk_size=self.bulk_chunk_size)
+            value = value.get(part)
+
+    return value
+
+
+class VWMultiSearch(object):
+    """
+    Sends the searches of several collections in one _msearch request.
+
+    ::
+
+        ms = VWMultiSearch()
+        ms.add(Users().filter_by(active=True), size=10)
+        ms.add(Orders().sort(created='desc'))
+        users, orders = ms.execute()
+
+    Collections must use the same connection.
+    """
+
+    def __init__(self, *collections):
+        self._searches = []  # (collection, kwargs for all())
+        for c in collections:
+            self.add(c)
+
+    def add(self, collection, **kwargs):
+        """ Adds the collection's search. kwargs are the same as all() """
+        if self._searches and self._searches[0][0].connection != collection.connection:
+            raise ValueError('All collections in a multi search must use the same connection')
+
+        self._searches.append((collection, kwargs))
+        return self
+
+    def __len__(self):
+        return len(self._searches)
+
+    def _create_msearch_body(self):
+        body = []
+        for collection, kwargs in self._searches:
+            body.extend(collection._create_msearch_params(**kwargs))
+
+        return body
+
+    # returns a VWCollectionGen or MultiSearchError for each response
+    def _create_results(self, responses, raise_on_error):
+        results = []
+        for position, response in enumerate(responses):
+            error = self._response_error(position, response, raise_on_error)
+            results.append(error or self._searches[position][0]._create_results(response))
+
+        return results
+
+    @staticmethod
+    def _response_error(position, response, raise_on_error):
+        if 'error' in response:
+            error = MultiSearchError(position, response.get('status'), response['error'])
+            if raise_on_error:
+                raise error
+
+            return error
+
+        return None
+
+    def execute(self, raise_on_error=False, **kwargs):
+        """
+        Sends the searches and returns a list with a VWCollectionGen for each
+        collection in the order they were added. Queries that failed are a
+        MultiSearchError in the list (or raised if raise_on_error is True)
+        """
+        if not self._searches:
+            return []
+
+        es = self._searches[0][0]._es
+        resp = es.msearch(body=self._create_msearch_body(), **kwargs)
+        return self._create_results(resp['responses'], raise_on_error)
+
+
+def msearch(*collections, **kwargs):
+    """ Shortcut for VWMultiSearch(*collections).execute(**kwargs) """
+    return VWMultiSearch(*collections).execute(**kwargs)
+
+
+class VWSnapshot(object):
+    """
+    Consistent paging over a collection's results. Opens a point in time
+    (Elasticsearch 7.10+) and pages with search_after sorted by the
+    collection's sort() plus the tiebreaker (_shard_doc). Clusters without
+    point in time are read with a scroll instead. Each request extends the
+    context by keep_alive.
+
+    ::
+
+        with Users().filter_by(active=True).sort(created='desc').snapshot(per_page=100) as snap:
+            first = snap.next_page()
+            second = snap.next_page()  # same view even while documents change
+
+    Iterating the snapshot yields every model. Pages are Page objects
+    numbered from 1 with the total from the first response.
+    """
+
+    def __init__(self, collection, keep_alive='5m', per_page=None, tiebreaker='_shard_doc', **kwargs):
+        self.collection = collection
+        self.keep_alive = keep_alive
+        self.per_page = per_page or collection.results_per_page
+        self.tiebreaker = tiebreaker
+        self.pit_id = None
+        self.scroll_id = None
+        self.search_after = None  # sort values of the last hit read
+        self.page = 0
+        self.total = None
+        self.exhausted = False
+        self._kwargs = kwargs
+        self._params = None
+        self._pending = None  # first scroll response, read by the first next_page()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            page = self.next_page()
+            if not page:
+                break
+
+            for obj in page:
+                yield obj
+
+    def _create_open_params(self):
+        index = self.collection.idx
+        if not isinstance(index, string_types):
+            index = ','.join(index)
+
+        return {'method': 'POST', 'url': '/%s/_pit' % index, 'params': {'keep_alive': self.keep_alive}}
+
+    # point in time searches don't take an index. The sort ends with the tiebreaker
+    def _create_pit_params(self):
+        params = self.collection._create_stream_params(search_after=True, tiebreaker=self.tiebreaker,
+                                                       size=self.per_page, **self._kwargs)
+        params.pop('index', None)
+        params.pop('doc_type', None)
+        return params
+
+    def _create_scroll_params(self):
+        return self.collection._create_stream_params(scroll=self.keep_alive, size=self.per_page, **self._kwargs)
+
+    def _create_search_params(self):
+        # copy so search_after isn't kept in the body
+        params = dict(self._params)
+        if self.pit_id:
+            params['body'] = dict(params['body'])
+            params['body']['pit'] = {'id': self.pit_id, 'keep_alive': self.keep_alive}
+            if self.search_after is not None:
+                params['body']['search_after'] = self.search_after
+
+        return params
+
+    # keeps the context id and position from a response. Returns False when there are no more results
+    def _read_page(self, results):
+        self.pit_id = results.get('pit_id', self.pit_id)
+        self.scroll_id = results.get('_scroll_id', self.scroll_id)
+
+        hits = results['hits']['hits']
+        if self.total is None:
+            self.total = results['hits'].get('total')
+
+        if not hits:
+            self.exhausted = True
+            return False
+
+        if len(hits) < self.per_page:
+            self.exhausted = True
+
+        if 'sort' in hits[-1]:
+            self.search_after = hits[-1]['sort']
+
+        self.page += 1
+        return True
+
+    def open(self):
+        """ Opens the point in time (or the scroll) """
+        if self._params is not None:
+            return self
+
+        es = self.collection._es
+        try:
+            resp = es.transport.perform_request(**self._create_open_params())
+            self.pit_id = resp['id']
+            self._params = self._create_pit_params()
+        except TransportError as e:
+            # older clusters reject the _pit endpoint. Connection errors are real failures
+            if isinstance(e, ESConnectionError):
+                raise
+
+            logger.debug('Point in time not available (%s). Using scroll' % e)
+            self._params = self._create_scroll_params()
+            self._pending = es.search(**self._params)
+            self.scroll_id = self._pending.get('_scroll_id')
+
+        return self
+
+    def next_page(self):
+        """ Returns the next Page of results or None when all were read """
+        self.open()
+        if self.exhausted:
+            return None
+
+        if self.pit_id:
+            results = self.collection._es.search(**self._create_search_params())
+        elif self._pending is not None:
+            results, self._pending = self._pending, None
+        else:
+            results = self.collection._es.scroll(scroll_id=self.scroll_id, scroll=self.keep_alive)
+
+        if not self._read_page(results):
+            return None
+
+        return self.collection._create_results(results, cls=Page, page=self.page, per_page=self.per_page)
+
+    def close(self):
+        """ Releases the point in time or scroll on the cluster """
+        es = self.collection._es
+        try:
+            if self.pit_id:
+                es.transport.perform_request('DELETE', '/_pit', body={'id': self.pit_id})
+            elif self.scroll_id:
+                es.clear_scroll(scroll_id=self.scroll_id)
+        except TransportError:
+            logger.debug('Failed to close snapshot %s' % (self.pit_id or self.scroll_id))
+
+        self.pit_id = None
+        self.scroll_id = None
+        self.exhausted = True
 
 
 class VWCollectionGen(VWCallback):
+    _deferred = None  # fields left out of the _source by only() / defer()
+    _deferred_mode = 'load'
+
     def __init__(self, base_obj, es_results):
         self.es_results = es_results
 
@@ -875,6 +2296,9 @@ class VWCollectionGen(VWCallback):
         self.count = 0
         self.base_obj = base_obj
 
+        # models are only created once per hit. Bounded by the size of the page
+        self._objects = [None] * len(self.doc_list)
+
     def __iter__(self):
         return self
 
@@ -883,36 +2307,138 @@ class VWCollectionGen(VWCallback):
         return self.next()
 
     def next(self):
-        self.count += 1
-        if self.count > len(self.doc_list):
-            raise StopIteration
+        while True:
+            self.count += 1
+            if self.count > len(self.doc_list):
+                raise StopIteration
 
-        doc = self.doc_list[self.count - 1]
+            # sometimes ES will return a "document" that has no _source
+            # this is a hack to skip it
+            if self.doc_list[self.count - 1].get('_source'):
+                return self._get_obj(self.count - 1)
 
-        # sometimes ES will return a "document" that has no _source
-        # this is a hack to skip it
-        if not doc.get('_source'):
-            return self.next()
+    # every model in the results without changing the position of the iterator
+    def _models(self):
+        return [self._get_obj(i) for i, doc in enumerate(self.doc_list) if doc.get('_source')]
 
-        return self._create_obj(doc)
+    def _get_obj(self, idx):
+        obj = self._objects[idx]
+        if obj is None:
+            obj = self._objects[idx] = self._create_obj(self.doc_list[idx])
+
+        return obj
 
     def _create_obj(self, doc):
         doc = self.base_obj.execute_class_callbacks('before_auto_create_model', doc)
 
         src = doc.get('_source')
-        src['_set_by_query'] = True
         src['id'] = doc.get('_id')
 
-        obj = self.base_obj(**src)
-        return obj.execute_callbacks('after_auto_create_model', obj, **src)
+        # docvalue_fields fill in fields that aren't in the _source
+        filled = set()
+        if doc.get('fields'):
+            for k, v in iteritems(doc['fields']):
+                if k not in src:
+                    src[k] = v[0] if isinstance(v, list) and len(v) == 1 else v
+                    filled.add(k)
+
+        if self._deferred:
+            obj = self.base_obj._create_from_query(src, self._deferred - filled, self._deferred_mode)
+        else:
+            obj = self.base_obj._create_from_query(src)
+
+        obj._set_version(doc)
+        return obj.execute_callbacks('after_auto_create_model', obj, _set_by_query=True, **src)
 
     # python abuse!
     # seriously though we want to act like a list in many cases
     def __getitem__(self, idx):
-        return self._create_obj(self.doc_list[idx])
+        if isinstance(idx, slice):
+            return [self._get_obj(i) for i in range(*idx.indices(len(self.doc_list)))]
+
+        if idx < 0:
+            idx += len(self.doc_list)
+
+        if idx < 0 or idx >= len(self.doc_list):
+            raise IndexError('VWCollectionGen index out of range')
+
+        return self._get_obj(idx)
 
     def __len__(self):
         return len(self.doc_list)
 
     def results(self):
         return self.es_results
+
+    @property
+    def total(self):
+        """ Number of documents that matched the search (hits.total). None for get_in() results """
+        try:
+            total = self.es_results['hits']['total']
+        except KeyError:
+            return None
+
+        # Elasticsearch 7+ returns {"value": n, "relation": "eq|gte"}
+        if isinstance(total, dict):
+            return total.get('value')
+
+        return total
+
+    @property
+    def total_relation(self):
+        """ "eq" if total is exact or "gte" if it is a lower bound (track_total_hits) """
+        try:
+            total = self.es_results['hits']['total']
+        except KeyError:
+            return None
+
+        if isinstance(total, dict):
+            return total.get('relation', 'eq')
+
+        return 'eq'
+
+
+class Page(VWCollectionGen):
+    """
+    A page of results from VWCollection.paginate(). Iterates and indexes the
+    same as VWCollectionGen.
+    """
+
+    def __init__(self, base_obj, es_results, page=1, per_page=None):
+        super(Page, self).__init__(base_obj, es_results)
+        self.page = page
+        self.per_page = per_page or len(self.doc_list)
+
+    @property
+    def items(self):
+        return self._models()
+
+    @property
+    def pages(self):
+        total = self.total or 0
+        if not self.per_page:
+            return 0
+
+        return (total + self.per_page - 1) // self.per_page
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def next_num(self):
+        if self.has_next:
+            return self.page + 1
+
+        return None
+
+    @property
+    def prev_num(self):
+        if self.has_prev:
+            return self.page - 1
+
+        return None
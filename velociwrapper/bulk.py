@@ -0,0 +1,175 @@
+""" bulk request helpers with retries on rejections and optional parallel chunks """
+
+from __future__ import absolute_import, unicode_literals
+
+import time
+from collections import deque
+
+from elasticsearch import helpers
+
+from . import config
+from .config import logger
+
+
+def expand_action(data):
+    """
+    Same as elasticsearch.helpers.expand_action but also moves if_seq_no and
+    if_primary_term (or _if_seq_no / _if_primary_term) into the action
+    metadata. Older clients leave them in the document
+    """
+    if isinstance(data, dict):
+        data = dict(data)
+        meta = {}
+        for key in ('if_seq_no', 'if_primary_term'):
+            for k in (key, '_' + key):
+                if k in data:
+                    meta[key] = data.pop(k)
+
+        action, source = helpers.expand_action(data)
+        if meta:
+            for op_type in action:
+                action[op_type].update(meta)
+
+        return action, source
+
+    return helpers.expand_action(data)
+
+
+def _chunk_actions(actions, chunk_size):
+    chunk = []
+    for action in actions:
+        chunk.append(action)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+# the cluster is overloaded and the document should be sent again
+def _is_rejected(item):
+    for op_type, info in item.items():
+        if info.get('status') == 429:
+            return True
+
+        error = str(info.get('error', '')).lower().replace('_', '')
+        if 'rejectedexecution' in error:
+            return True
+
+    return False
+
+
+def _send_chunk(client, chunk, max_chunk_bytes, max_retries, initial_backoff, max_backoff, **kwargs):
+    """
+    Sends a chunk of actions and returns a list of (ok, item) in the same order.
+    Documents rejected with 429 / es_rejected_execution_exception are sent
+    again with exponential backoff.
+    """
+    results = [None] * len(chunk)
+    pending = list(range(len(chunk)))
+    attempt = 0
+
+    while pending:
+        actions = [chunk[i] for i in pending]
+        responses = helpers.streaming_bulk(client, actions, chunk_size=len(actions), max_chunk_bytes=max_chunk_bytes,
+                                           raise_on_error=False, raise_on_exception=False, **kwargs)
+
+        retry = []
+        for i, (ok, item) in zip(pending, responses):
+            results[i] = (ok, item)
+            if not ok and attempt < max_retries and _is_rejected(item):
+                retry.append(i)
+
+        if retry:
+            delay = min(max_backoff, initial_backoff * 2 ** attempt)
+            logger.warning('%i document(s) rejected by the cluster. Retrying in %s seconds' % (len(retry), delay))
+            time.sleep(delay)
+
+        pending = retry
+        attempt += 1
+
+    return results
+
+
+def streaming_bulk(client, actions, chunk_size=None, max_chunk_bytes=None, thread_count=None, queue_size=None,
+                   max_retries=None, initial_backoff=None, max_backoff=None, **kwargs):
+    """
+    Sends the actions in bulk and yields (ok, item) for each one in the order
+    they were given.
+
+    Args:
+        client: Elasticsearch client
+        actions: iterable of bulk actions
+        chunk_size: documents per request (config.bulk_chunk_size)
+        max_chunk_bytes: maximum bytes per request (config.bulk_max_chunk_bytes)
+        thread_count: number of requests to run at once (config.bulk_thread_count)
+        queue_size: maximum number of chunks read ahead of the results
+            (config.bulk_queue_size or thread_count * 2)
+        max_retries: times to retry rejected documents (config.bulk_max_retries)
+        initial_backoff: seconds to wait before the first retry. Doubles each retry
+        max_backoff: maximum seconds to wait between retries
+    """
+    chunk_size = chunk_size or config.bulk_chunk_size
+    max_chunk_bytes = max_chunk_bytes or config.bulk_max_chunk_bytes
+    thread_count = thread_count or config.bulk_thread_count
+    queue_size = queue_size or config.bulk_queue_size or thread_count * 2
+
+    send_kwargs = {
+        'max_chunk_bytes': max_chunk_bytes,
+        'max_retries': config.bulk_max_retries if max_retries is None else max_retries,
+        'initial_backoff': config.bulk_initial_backoff if initial_backoff is None else initial_backoff,
+        'max_backoff': config.bulk_max_backoff if max_backoff is None else max_backoff
+    }
+    send_kwargs.update(kwargs)
+    send_kwargs.setdefault('expand_action_callback', expand_action)
+
+    chunks = _chunk_actions(actions, chunk_size)
+
+    if thread_count <= 1:
+        for chunk in chunks:
+            for result in _send_chunk(client, chunk, **send_kwargs):
+                yield result
+        return
+
+    # Avoid importing multiprocessing unless needed (same as the elasticsearch helpers)
+    from multiprocessing.dummy import Pool
+    pool = Pool(thread_count)
+
+    # chunks are submitted as results are read so only queue_size chunks are in memory at once.
+    # Results are read in order of submission
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(_send_chunk, (client, chunk), send_kwargs))
+            if len(pending) >= queue_size:
+                for result in pending.popleft().get():
+                    yield result
+
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def bulk(client, actions, raise_on_error=True, **kwargs):
+    """
+    Sends the actions in bulk. Accepts the same arguments as streaming_bulk()
+
+    Returns a tuple of the number of successful actions and a list of the
+    failed ones. Raises BulkIndexError if any failed and raise_on_error is True
+    """
+    success = 0
+    errors = []
+    for ok, item in streaming_bulk(client, actions, **kwargs):
+        if ok:
+            success += 1
+        else:
+            errors.append(item)
+
+    if errors and raise_on_error:
+        raise helpers.BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+
+    return success, errors
@@ -0,0 +1,130 @@
+""" caches for search and count results. Set __cache__ on a collection to use one """
+
+from __future__ import absolute_import, unicode_literals
+from six import string_types
+
+import time
+import json
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+from . import config
+
+# every cache created. Writes invalidate all of them
+_caches = weakref.WeakSet()
+_caches_lock = threading.Lock()
+
+
+def cache_key(op, params):
+    """
+    Returns a hash of the request. Parameters (index, type, body, sort, size,
+    from, etc.) are serialized with sorted keys so equal requests get the
+    same key
+    """
+    request = json.dumps([op, params], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(request.encode('utf-8')).hexdigest()
+
+
+# returns the list of index names in an index parameter ("a,b" or ["a", "b"])
+def index_names(index):
+    if index is None:
+        return []
+
+    if isinstance(index, string_types):
+        return index.split(',')
+
+    return list(index)
+
+
+class ResultCache(object):
+    """
+    Interface for result caches. Values are JSON strings so cached results
+    can't be changed by the code using them. Subclass to share results
+    between processes (redis, memcached, etc.).
+
+    Caches register themselves when created so writes through models and
+    collections can invalidate them.
+    """
+
+    def __init__(self):
+        with _caches_lock:
+            _caches.add(self)
+
+    def get(self, key):
+        """ Returns the value for key or None """
+        raise NotImplementedError
+
+    def set(self, key, value, indexes):
+        """ Stores value. indexes is the list of index names the result was read from """
+        raise NotImplementedError
+
+    def invalidate(self, index):
+        """ Discards every result read from index. Called on every write so it should be cheap """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(ResultCache):
+    """
+    In-process cache that keeps up to ``max_size`` results for ``ttl``
+    seconds (defaults config.cache_max_size and config.cache_ttl). The least
+    recently used result is dropped when the cache is full.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        super(LRUCache, self).__init__()
+        self.max_size = max_size or config.cache_max_size
+        self.ttl = config.cache_ttl if ttl is None else ttl
+        self._entries = OrderedDict()  # key => (expires, [(index, generation)], value)
+        self._generations = {}  # invalidating an index increments its generation instead of scanning entries
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, generations, value = self._entries[key]
+            except KeyError:
+                return None
+
+            if expires < time.time() or any(self._generations.get(i, 0) != g for i, g in generations):
+                del self._entries[key]
+                return None
+
+            # move to the end (most recently used)
+            del self._entries[key]
+            self._entries[key] = (expires, generations, value)
+            return value
+
+    def set(self, key, value, indexes):
+        with self._lock:
+            self._entries.pop(key, None)
+            generations = [(i, self._generations.get(i, 0)) for i in indexes]
+            self._entries[key] = (time.time() + self.ttl, generations, value)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, index):
+        with self._lock:
+            self._generations[index] = self._generations.get(index, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def invalidate(index):
+    """ Invalidates the results read from index (str or list) in every cache """
+    with _caches_lock:
+        caches = list(_caches)
+
+    for name in index_names(index):
+        for cache in caches:
+            cache.invalidate(name)
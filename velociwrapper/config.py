@@ -25,6 +25,29 @@ default_index = 'es_model'
 # Default number of entries on bulk requests
 bulk_chunk_size = 1000
 
+# Maximum size in bytes of a single bulk request
+bulk_max_chunk_bytes = 100 * 1024 * 1024
+
+# Number of bulk requests to send at once. 1 sends them one after another
+bulk_thread_count = 1
+
+# Number of chunks that can wait for a bulk thread (defaults to bulk_thread_count * 2)
+bulk_queue_size = None
+
+# Retries for documents rejected by the cluster (HTTP 429)
+bulk_max_retries = 3
+
+# Seconds to wait before retrying rejected documents. Doubles on each retry up to bulk_max_backoff
+bulk_initial_backoff = 2
+bulk_max_backoff = 600
+
+# Number of ids in each request sent by VWCollection.get_many()
+mget_chunk_size = 1000
+
+# Seconds and number of results kept by cache.LRUCache
+cache_ttl = 60
+cache_max_size = 1000
+
 # Default number of matches to return per page
 results_per_page = 50
 
@@ -57,6 +80,41 @@ if os.environ.get('VW_BULK_CHUNK_SIZE'):
     except ValueError:
         logger.warn('invalid value for VW_BULK_CHUNK_SIZE, expected integer. Using default')
 
+if os.environ.get('VW_BULK_MAX_CHUNK_BYTES'):
+    try:
+        bulk_max_chunk_bytes = int(os.environ.get('VW_BULK_MAX_CHUNK_BYTES'))
+        logger.debug('bulk_max_chunk_bytes set from environment')
+    except ValueError:
+        logger.warning('Invalid value for VW_BULK_MAX_CHUNK_BYTES, expected integer. Using default')
+
+if os.environ.get('VW_BULK_THREAD_COUNT'):
+    try:
+        bulk_thread_count = int(os.environ.get('VW_BULK_THREAD_COUNT'))
+        logger.debug('bulk_thread_count set from environment')
+    except ValueError:
+        logger.warning('Invalid value for VW_BULK_THREAD_COUNT, expected integer. Using default')
+
+if os.environ.get('VW_BULK_MAX_RETRIES'):
+    try:
+        bulk_max_retries = int(os.environ.get('VW_BULK_MAX_RETRIES'))
+        logger.debug('bulk_max_retries set from environment')
+    except ValueError:
+        logger.warning('Invalid value for VW_BULK_MAX_RETRIES, expected integer. Using default')
+
+if os.environ.get('VW_MGET_CHUNK_SIZE'):
+    try:
+        mget_chunk_size = int(os.environ.get('VW_MGET_CHUNK_SIZE'))
+        logger.debug('mget_chunk_size set from environment')
+    except ValueError:
+        logger.warning('Invalid value for VW_MGET_CHUNK_SIZE, expected integer. Using default')
+
+if os.environ.get('VW_CACHE_TTL'):
+    try:
+        cache_ttl = int(os.environ.get('VW_CACHE_TTL'))
+        logger.debug('cache_ttl set from environment')
+    except ValueError:
+        logger.warning('Invalid value for VW_CACHE_TTL, expected integer. Using default')
+
 if os.environ.get('VW_CONNECTION_PARAMS'):
     try:
         connection_params = json.loads(os.environ.get('VW_CONNECTION_PARAMS'))
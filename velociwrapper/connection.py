@@ -0,0 +1,206 @@
+""" process-wide registry of Elasticsearch clients shared by models, collections and mappers """
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import json
+import threading
+import weakref
+
+from elasticsearch import Elasticsearch
+
+try:
+    from elasticsearch import AsyncElasticsearch
+except ImportError:
+    try:
+        from elasticsearch_async import AsyncElasticsearch
+    except ImportError:
+        AsyncElasticsearch = None
+
+from . import config
+from .config import logger
+
+DEFAULT_CONNECTION = 'default'
+
+# named connection specs. name => (dsn, params)
+# the default connection is not stored here. It always reads config.dsn and
+# config.connection_params so changes to the config are picked up
+_connections = {}
+
+# clients keyed by the dsn and params they were built with
+_clients = {}
+
+# asyncio clients are kept apart and per event loop (loop => {key: client}). A client is bound to the loop it was
+# created in so a new loop (another asyncio.run(), test runners, etc.) gets new clients
+_async_clients = weakref.WeakKeyDictionary()
+
+_lock = threading.RLock()
+
+# the pid that created the clients. urllib3 pools can't be shared across a fork
+_pid = os.getpid()
+
+
+def _client_key(dsn, params):
+    return json.dumps([dsn, params], sort_keys=True, default=repr)
+
+
+def _check_fork():
+    global _pid
+    if _pid != os.getpid():
+        with _lock:
+            if _pid != os.getpid():
+                logger.debug('process forked. Discarding inherited Elasticsearch clients')
+                _clients.clear()
+                _async_clients.clear()
+                _pid = os.getpid()
+
+
+def register_connection(name, dsn=None, **params):
+    """
+    Registers a named connection. Models and collections use it by setting
+    __connection__ = name
+
+    Args:
+        name: str name of the connection
+        dsn: list of nodes (defaults to config.dsn)
+        **params: parameters for the client (defaults to config.connection_params)
+    """
+    if dsn is None:
+        dsn = config.dsn
+
+    if not params:
+        params = dict(config.connection_params)
+
+    with _lock:
+        _connections[name] = (dsn, params)
+
+
+def unregister_connection(name):
+    with _lock:
+        try:
+            del _connections[name]
+        except KeyError:
+            pass
+
+
+def get_client(dsn=None, **params):
+    """
+    Returns the shared client for the dsn and params, creating it if needed.
+    Clients with the same dsn and params are only ever created once per process.
+    """
+    if dsn is None:
+        dsn = config.dsn
+
+    if not params:
+        params = config.connection_params
+
+    _check_fork()
+
+    key = _client_key(dsn, params)
+    try:
+        return _clients[key]
+    except KeyError:
+        pass
+
+    with _lock:
+        if key not in _clients:
+            _clients[key] = Elasticsearch(dsn, **params)
+
+        return _clients[key]
+
+
+def get_async_client(dsn=None, **params):
+    """
+    Same as get_client() but returns an AsyncElasticsearch client. Requires
+    elasticsearch>=7.8 or the elasticsearch-async package
+    """
+    if AsyncElasticsearch is None:
+        raise ImportError('Async support requires AsyncElasticsearch (elasticsearch>=7.8 or elasticsearch-async)')
+
+    if dsn is None:
+        dsn = config.dsn
+
+    if not params:
+        params = config.connection_params
+
+    _check_fork()
+
+    loop = _current_loop()
+    key = _client_key(dsn, params)
+    try:
+        return _async_clients[loop][key]
+    except KeyError:
+        pass
+
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = AsyncElasticsearch(dsn, **params)
+
+        return clients[key]
+
+
+def _current_loop():
+    # imported here. asyncio isn't available on Python 2
+    import asyncio
+    try:
+        return asyncio.get_running_loop()
+    except (AttributeError, RuntimeError):
+        # Python 3.6 or called outside of a coroutine
+        return asyncio.get_event_loop()
+
+
+def _connection_spec(name):
+    if name is None or name == DEFAULT_CONNECTION:
+        return None, {}
+
+    try:
+        return _connections[name]
+    except KeyError:
+        raise KeyError('No connection registered as "%s"' % name)
+
+
+def get_async_connection(name=None):
+    """ Same as get_connection() but returns the AsyncElasticsearch client """
+    dsn, params = _connection_spec(name)
+    return get_async_client(dsn, **params)
+
+
+def get_connection(name=None):
+    """
+    Returns the shared client for a named connection. None or "default" returns
+    the client for config.dsn and config.connection_params
+    """
+    dsn, params = _connection_spec(name)
+    return get_client(dsn, **params)
+
+
+def warm_connections(names=None, ping=True):
+    """
+    Creates the clients for the named connections ahead of time (all registered
+    connections and the default if names is None). When ping is True a request
+    is sent on each client so the connection pool is open before the first query.
+
+    Returns a dict of name => ping result (or None when ping is False)
+    """
+    if names is None:
+        names = [DEFAULT_CONNECTION] + list(_connections)
+
+    results = {}
+    for name in names:
+        es = get_connection(name)
+        results[name] = None
+        if ping:
+            results[name] = es.ping()
+
+    return results
+
+
+def reset_connections():
+    """
+    Discards all the created clients. Registered connections are kept. Async
+    clients are dropped without being closed; await their close() first if needed
+    """
+    with _lock:
+        _clients.clear()
+        _async_clients.clear()
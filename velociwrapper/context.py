@@ -0,0 +1,54 @@
+""" stacks of active identity maps and sessions """
+
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None  # python 2. Stacks are kept per thread
+
+
+class ContextStack(object):
+    """
+    A stack kept per asyncio task and thread. Tasks start with the stack of
+    the task that created them but pushing in one task does not change
+    another's. Falls back to one stack per thread when contextvars is not
+    available
+    """
+
+    def __init__(self, name):
+        if contextvars is not None:
+            self._var = contextvars.ContextVar(name, default=())
+        else:
+            self._var = None
+            self._local = threading.local()
+
+    def _get(self):
+        if self._var is not None:
+            return self._var.get()
+
+        return getattr(self._local, 'stack', ())
+
+    def _set(self, stack):
+        if self._var is not None:
+            self._var.set(stack)
+        else:
+            self._local.stack = stack
+
+    def push(self, obj):
+        # the stack is never changed in place as it can be shared with other tasks
+        self._set(self._get() + (obj,))
+
+    def remove(self, obj):
+        stack = list(self._get())
+        stack.remove(obj)
+        self._set(tuple(stack))
+
+    def top(self):
+        stack = self._get()
+        return stack[-1] if stack else None
+
+    def __iter__(self):
+        return iter(self._get())
@@ -3,6 +3,7 @@ from six import iteritems, string_types, add_metaclass
 from past.builtins import unicode, long
 
 from datetime import date, datetime
+from collections import OrderedDict
 import re
 
 from .config import logger
@@ -13,68 +14,118 @@ __all__ = [
 ]
 
 
-# check the python type and return the appropriate ESType class
-def create_es_type(value):
-    # check if we're already an es type
-    try:
-        if type(value).__class__ == ESType:
-            return value
-    except AttributeError:
-        pass
+# timezone offsets are removed before trying the date formats
+_tz_suffix = re.compile(r'(?:Z|\s*[\+\-]\d\d:?\d\d)$')
+_ip_address = re.compile(r'^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$')
 
-    if isinstance(value, string_types):
-        # strings could be a lot of things
-        # try to see if it might be a date
+# dateutil isn't good at determining if we have a date (ok at parsing if we know there's a date).
+# To that end we'll only accept a couple of valid formats
+_date_formats = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d')
 
-        # dateutil isn't good at determining if we have a date (ok at parsing if we know there's a date).
-        # To that end we'll only accept a couple of valid formats
-        test_date = value.strip()
-        test_date = re.sub("(?:Z|\s*[\+\-]\d\d:?\d\d)$", '', test_date)
+# recent string values and what they were inferred as. Only short strings are kept
+_inferred = OrderedDict()
+_inferred_max = 1024
+_inferred_max_length = 64
 
-        try:
-            test_date = datetime.strptime(test_date, '%Y-%m-%d %H:%M:%S')
-            return DateTime(test_date)
 
-        except ValueError:
+def _infer_string(value):
+    """
+    Returns what kind of value a string contains as a tuple of the kind
+    ('datetime', 'date', 'ip', 'int', 'float' or 'string') and the parsed date
+    """
+    test_date = value.strip()
+
+    # all the formats start with a 4 digit year. Skip strptime() if it can't match
+    if len(test_date) >= 8 and test_date[4:5] == '-' and test_date[:4].isdigit():
+        test_date = _tz_suffix.sub('', test_date)
+        for fmt in _date_formats:
             try:
-                test_date = datetime.strptime(test_date, '%Y-%m-%dT%H:%M:%S')
-                return DateTime(test_date)
+                parsed = datetime.strptime(test_date, fmt)
             except ValueError:
+                continue
 
-                try:
-                    test_date = datetime.strptime(test_date, '%Y-%m-%dT%H:%M:%S.%f')
-                    return DateTime(test_date)
-                except ValueError:
-                    try:
-                        test_date = datetime.strptime(test_date, '%Y-%m-%d')
-                        return Date(test_date.date())
-                    except ValueError:
-                        pass
+            if fmt == '%Y-%m-%d':
+                return 'date', parsed.date()
 
-        # see if it might be an ip address
+            return 'datetime', parsed
+
+    # see if it might be an ip address
+    if value.count('.') == 3:
+        matches = _ip_address.search(value)
+        if matches:
+            valid_ip = True
+            for g in matches.groups():
+                g = int(g)
+                if g < 1 or g > 254:
+                    # nope
+                    valid_ip = False
+
+            if valid_ip:
+                return 'ip', None
+
+    try:
+        int(value)
+        return 'int', None
+    except ValueError:
         try:
-            matches = re.search('^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$', value)
-            if matches:
-                valid_ip = True
-                for g in matches.groups():
-                    g = int(g)
-                    if g < 1 or g > 254:
-                        # nope
-                        valid_ip = False
-
-                if valid_ip:
-                    return IP(value)
-        except:
+            float(value)
+            return 'float', None
+        except ValueError:
+            return 'string', None
+
+
+def _create_string_es_type(value):
+    cacheable = len(value) <= _inferred_max_length
+
+    kind = None
+    if cacheable:
+        try:
+            # move to the end so the least recently used is dropped first
+            kind, parsed = _inferred.pop(value)
+            _inferred[value] = (kind, parsed)
+        except KeyError:
             pass
 
-        if isinstance(value, string_types):
-            try:
-                value = int(value)
-            except ValueError:
+    if kind is None:
+        kind, parsed = _infer_string(value)
+        if cacheable:
+            _inferred[value] = (kind, parsed)
+            while len(_inferred) > _inferred_max:
                 try:
-                    value = float(value)
-                except ValueError:
-                    return String(value)
+                    _inferred.popitem(last=False)
+                except KeyError:
+                    break
+
+    if kind == 'datetime':
+        return DateTime(parsed)
+
+    elif kind == 'date':
+        return Date(parsed)
+
+    elif kind == 'ip':
+        return IP(value)
+
+    elif kind == 'int':
+        return create_es_type(int(value))
+
+    elif kind == 'float':
+        return create_es_type(float(value))
+
+    return String(value)
+
+
+# check the python type and return the appropriate ESType class
+def create_es_type(value):
+    # check if we're already an es type
+    try:
+        if type(value).__class__ == ESType:
+            return value
+    except AttributeError:
+        pass
+
+    if isinstance(value, string_types):
+        # strings could be a lot of things. Work out which (cached for recent values)
+        return _create_string_es_type(value)
 
     if isinstance(value, int):
         return Integer(value)
@@ -137,6 +188,118 @@ def is_analyzed(value):
     return analyzed
 
 
+# default accepted properties on various classes
+# the values are set by ES and are only here for completeness
+_es_properties = {
+    'Any': {
+        'index_name': '',
+        'store': False,
+        'boost': '1.0',
+        'null_value': None,
+        'include_in_all': True,
+        'doc_values': False,
+        'fielddata': {},
+        'copy_to': '',
+        'similarity': 'default',
+        'fields': {},
+        'meta_': {}
+    },
+    'String': {
+        'analyzed': True,
+        'norms': False,
+        'index_options': None,
+        'analyzer': 'default',
+        'index_analyzer': 'default',
+        'search_analyzer': 'default',
+        'ignore_above': 'default',
+        'position_offset_gap': 0,
+        'value_': '',
+        'boost_': '1.0'
+    },
+    'Number': {
+        'type_': 'float',
+        'index_': 'no',
+        'precision_step': 16,
+        'ignore_malformed': False,
+        'coerce': True
+    },
+    'Integer': {
+        'type_': 'float',
+        'index_': 'no',
+        'precision_step': 16,
+        'ignore_malformed': False,
+        'coerce': True
+    },
+    'Long': {
+        'type_': 'long',
+        'index_': 'no',
+        'precision_step': 16,
+        'ignore_malformed': False,
+        'coerce': True
+    },
+    'Date': {
+        'format': 'dateOptionalTime',
+        'precision_step': 16,
+        'ignore_malformed': False
+    },
+    'DateTime': {
+        'type_': 'date',  # set explicitly because ES only has type as "date"
+        'format': 'dateOptionalTime',
+        'precision_step': 16,
+        'ignore_malformed': False
+    },
+    'Binary': {
+        'compress': False,
+        'compress_threshold': -1
+    },
+    'IP': {
+        'precision_step': 16
+    },
+    'GeoPoint': {
+        'type_': 'geo_point',
+        'lat_lon': False,
+        'geohash': False,
+        'geohash_precision': 12,
+        'geohash_prefix': False,
+        'validate': False,
+        'validate_lat': False,
+        'validate_lon': False,
+        'normalize': True,
+        'normalize_lat': False,
+        'normalize_lon': False,
+        'precision_step': 16
+    },
+    'GeoShape': {
+        'tree': 'geohash',
+        'tree_levels': '',
+        'distance_error_pct': 0.5
+    }
+    # attachment not specified because it has no other args
+}
+
+_es_properties['Array'] = {}
+for _k, _v in iteritems(_es_properties):
+    if _k == 'Array':
+        continue
+
+    _es_properties['Array'].update(_v)
+
+# property names that don't map directly to the name Elasticsearch uses
+_es_key_renames = {'meta_': '_meta', 'value_': '_value', 'boost_': '_boost', 'analyzed': 'index'}
+
+
+def _es_key_name(k):
+    try:
+        return _es_key_renames[k]
+    except KeyError:
+        pass
+
+    if k[len(k) - 1] == '_':
+        return k[0:len(k) - 1]
+
+    return k
+
+
 class ESType(type):
     @classmethod
     def build_map(cls, d):
@@ -166,160 +329,65 @@ class ESType(type):
         return {}  # I *think* we should never end up here
 
     def __new__(cls, clsname, bases, dct):
-        # default accepted properties on various classes
-        # the values are set by ES and are only here for completeness
-        dct['__es_properties__'] = {
-            'Any': {
-                'index_name': '',
-                'store': False,
-                'boost': '1.0',
-                'null_value': None,
-                'include_in_all': True,
-                'doc_values': False,
-                'fielddata': {},
-                'copy_to': '',
-                'similarity': 'default',
-                'fields': {},
-                'meta_': {}
-            },
-            'String': {
-                'analyzed': True,
-                'norms': False,
-                'index_options': None,
-                'analyzer': 'default',
-                'index_analyzer': 'default',
-                'search_analyzer': 'default',
-                'ignore_above': 'default',
-                'position_offset_gap': 0,
-                'value_': '',
-                'boost_': '1.0'
-            },
-            'Number': {
-                'type_': 'float',
-                'index_': 'no',
-                'precision_step': 16,
-                'ignore_malformed': False,
-                'coerce': True
-            },
-            'Integer': {
-                'type_': 'float',
-                'index_': 'no',
-                'precision_step': 16,
-                'ignore_malformed': False,
-                'coerce': True
-            },
-            'Long': {
-                'type_': 'long',
-                'index_': 'no',
-                'precision_step': 16,
-                'ignore_malformed': False,
-                'coerce': True
-            },
-            'Date': {
-                'format': 'dateOptionalTime',
-                'precision_step': 16,
-                'ignore_malformed': False
-            },
-            'DateTime': {
-                'type_': 'date',  # set explicitly because ES only has type as "date"
-                'format': 'dateOptionalTime',
-                'precision_step': 16,
-                'ignore_malformed': False
-            },
-            'Binary': {
-                'compress': False,
-                'compress_threshold': -1
-            },
-            'IP': {
-                'precision_step': 16
-            },
-            'GeoPoint': {
-                'type_': 'geo_point',
-                'lat_lon': False,
-                'geohash': False,
-                'geohash_precision': 12,
-                'geohash_prefix': False,
-                'validate': False,
-                'validate_lat': False,
-                'validate_lon': False,
-                'normalize': True,
-                'normalize_lat': False,
-                'normalize_lon': False,
-                'precision_step': 16
-            },
-            'GeoShape': {
-                'tree': 'geohash',
-                'tree_levels': '',
-                'distance_error_pct': 0.5
-            }
-            # attachment not specified because it has no other args
-        }
-
-        dct['__es_properties__']['Array'] = {}
-        for k, v in iteritems(dct['__es_properties__']):
-            if k == 'Array':
-                continue
-
-            dct['__es_properties__']['Array'].update(v)
+        dct['__es_properties__'] = _es_properties
 
         def get_prop_dict(self):
             es_type = self.__class__.__name__.lower()
             prop_dict = {"type": es_type}
 
-            valid = []
-            for obj in self.__class__.mro():
-                if obj.__name__ in self.__es_properties__:
-                    valid.extend(list(self.__es_properties__.get(obj.__name__)))
-
-            valid.extend(list(self.__es_properties__.get('Any')))
-
-            for k in dir(self):
-                if k in valid:
+            for k, keyname in self.__es_prop_keys__:
+                try:
                     v = getattr(self, k)
+                except AttributeError:
+                    continue
 
-                    keyname = k
-                    if k[len(k) - 1] == "_":
-                        if k in ['meta_', 'value_', 'boost_']:
-                            keyname = '_' + k[0:len(k) - 1]
-                        else:
-                            keyname = k[0:len(k) - 1]
-
-                    elif k == 'analyzed':
-                        keyname = 'index'
-                        if v or v == None:
-                            v = 'analyzed'
-                        else:
-                            v = 'not_analyzed'
+                if k == 'analyzed':
+                    if v or v == None:
+                        v = 'analyzed'
+                    else:
+                        v = 'not_analyzed'
 
-                    if v != None:
-                        if isinstance(v, dict) or isinstance(v, list):
-                            v = self.__class__.build_map(v)
+                if v != None:
+                    if isinstance(v, dict) or isinstance(v, list):
+                        v = self.__class__.build_map(v)
 
-                        prop_dict[keyname] = v
+                    prop_dict[keyname] = v
 
             return prop_dict
 
         # for recreating the arguments in a new instance
         def get_es_arguments(self):
             arg_dict = {}
-            valid = {}
-            valid.update(self.__es_properties__.get('Any'))
-
-            try:
-                valid.update(self.__es_properties__.get(self.__class__.__name__))
-            except TypeError:
-                pass
+            for k in self.__es_arg_keys__:
+                try:
+                    arg_dict[k] = getattr(self, k)
+                except AttributeError:
+                    pass
 
-            for k in dir(self):
-                if k in valid:
-                    v = getattr(self, k)
-                    arg_dict[k] = v
             return arg_dict
 
         dct['prop_dict'] = get_prop_dict
         dct['es_args'] = get_es_arguments
 
-        return super(ESType, cls).__new__(cls, clsname, bases, dct)
+        new_cls = super(ESType, cls).__new__(cls, clsname, bases, dct)
+
+        # the property tables are worked out once per class
+        valid = set(_es_properties.get('Any'))
+        for obj in new_cls.mro():
+            valid.update(_es_properties.get(obj.__name__, ()))
+
+        # keyword arguments to __call__() that are for elastic search
+        new_cls.__es_valid_kwargs__ = frozenset(valid)
+
+        # (attribute, mapping key) for prop_dict(). Sorted to match the previous dir() order
+        new_cls.__es_prop_keys__ = tuple((k, _es_key_name(k)) for k in sorted(valid))
+
+        # attributes returned by es_args()
+        arg_keys = set(_es_properties.get('Any'))
+        arg_keys.update(_es_properties.get(clsname, ()))
+        new_cls.__es_arg_keys__ = tuple(sorted(arg_keys))
+
+        return new_cls
 
     def __call__(cls, *args, **kwargs):
         # we have to split kw args going to the base class
@@ -327,20 +395,33 @@ class ESType(type):
         # annoying but not a big deal
         base_kwargs = {}
         es_kwargs = {}
-        _name_ = cls.__name__
-
-        valid = []
-        for obj in cls.mro():
-            if obj.__name__ in cls.__es_properties__:
-                valid.extend(list(cls.__es_properties__.get(obj.__name__)))
-        valid.extend(list(cls.__es_properties__.get('Any')))
 
+        valid = cls.__es_valid_kwargs__
         for k, v in iteritems(kwargs):
             if k in valid:
                 es_kwargs[k] = v
             else:
                 base_kwargs[k] = v
 
+        inst = cls.__create(args, base_kwargs)
+        if es_kwargs:
+            inst.__dict__.update(es_kwargs)
+
+        return inst
+
+    def with_es_args(cls, value, es_args):
+        """
+        Creates an instance for value using the es_args() of an existing
+        instance. The arguments are copied as they are without checking them
+        again.
+        """
+        inst = cls.__create((value,), {})
+        if es_args:
+            inst.__dict__.update(es_args)
+
+        return inst
+
+    def __create(cls, args, base_kwargs):
         # fix for datetime calls. I really dont like this but I can't seem
         # to hook it anywhere
 
@@ -355,12 +436,7 @@ class ESType(type):
             elif cls == Date and isinstance(a, date):
                 args = [a.year, a.month, a.day]
 
-        inst = super(ESType, cls).__call__(*args, **base_kwargs)
-
-        for k, v in iteritems(es_kwargs):
-            setattr(inst, k, v)  # testing
-
-        return inst
+        return super(ESType, cls).__call__(*args, **base_kwargs)
 
 
 # lists
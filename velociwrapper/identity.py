@@ -2,6 +2,85 @@
 
 from __future__ import absolute_import, unicode_literals
 
+from past.builtins import unicode
+
+from .context import ContextStack
+
 
 class VWIdentity(object):
-    pass
\ No newline at end of file
+    pass
+
+
+# stack of active identity maps for each task and thread
+_stack = ContextStack('vw_identity_maps')
+
+
+class IdentityMap(object):
+    """
+    Keeps the models returned by VWCollection.get() and get_in() by
+    (index, type, id) while the map is active so the same document is only
+    fetched once.
+
+    Use as a context manager. Maps are per thread and asyncio task and can be
+    nested (the innermost is used)::
+
+        with IdentityMap():
+            user = Users().get(user_id)
+            Users().get(user_id) is user  # True. No request
+    """
+
+    def __init__(self):
+        self._objects = {}
+
+    def __enter__(self):
+        _stack.push(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _stack.remove(self)
+        self.clear()
+
+    def __contains__(self, key):
+        return key in self._objects
+
+    def __len__(self):
+        return len(self._objects)
+
+    def get(self, key, default=None):
+        return self._objects.get(key, default)
+
+    def add(self, key, obj):
+        self._objects[key] = obj
+
+    def discard(self, key):
+        self._objects.pop(key, None)
+
+    def invalidate(self, index, doc_type=None):
+        """ Discards every model in the index (and type if given) """
+        for key in list(self._objects):
+            if key[0] == index and (doc_type is None or key[1] == doc_type):
+                del self._objects[key]
+
+    def clear(self):
+        self._objects.clear()
+
+
+def current_map():
+    """ Returns the active IdentityMap for the task or thread or None """
+    return _stack.top()
+
+
+def key(index, doc_type, id):
+    """ Returns the key of a document. Ids are strings, the same as _id in responses, so numbers are found """
+    return index, doc_type, None if id is None else unicode(id)
+
+
+def discard(index, doc_type, id):
+    """ Removes a document from every active map in the task or thread """
+    for identity_map in _stack:
+        identity_map.discard(key(index, doc_type, id))
+
+
+def invalidate(index, doc_type=None):
+    for identity_map in _stack:
+        identity_map.invalidate(index, doc_type)
@@ -1,14 +1,13 @@
 from __future__ import absolute_import, unicode_literals
 from six import iteritems
-from . import config
-from elasticsearch import Elasticsearch, client, helpers
+from . import config, connection, bulk
+from elasticsearch import client, helpers
 from .config import logger
 from .relationship import relationship
 from .es_types import *
 from .base import VWBase
 from .util import all_subclasses
 import json
-import inspect
 
 
 class MapperError(Exception):
@@ -17,12 +16,27 @@ class MapperError(Exception):
 
 # tools for creating or reindexing elasticsearch mapping
 class Mapper(object):
-    def __init__(self, connect_args=None):
+    def __init__(self, connect_args=None, connection_name=None):
         if not isinstance(connect_args, dict):
             connect_args = {}
 
-        self._es = Elasticsearch(config.dsn, **config.connection_params)
-        self._esc = client.IndicesClient(self._es)
+        self._connect_args = connect_args
+        self.connection = connection_name
+
+    @property
+    def _es(self):
+        # connect_args override the connection parameters for this mapper only
+        if self._connect_args:
+            params = dict(config.connection_params)
+            params.update(self._connect_args)
+            dsn = params.pop('dsn', config.dsn)
+            return connection.get_client(dsn, **params)
+
+        return connection.get_connection(self.connection)
+
+    @property
+    def _esc(self):
+        return client.IndicesClient(self._es)
 
     # Retrieves the mapping as defined by the server
     def get_server_mapping(self, **kwargs):
@@ -94,12 +108,9 @@ class Mapper(object):
                 # to add other features. We will skip mapping
                 continue
 
-            for k, v in inspect.getmembers(sc):
-                try:
-                    if type(v).__class__ == ESType:
-                        sc_body[sc.__type__]['properties'][k] = v.prop_dict()
-                except AttributeError:
-                    pass
+            schema = sc.__schema__
+            for k in schema.es_fields:
+                sc_body[sc.__type__]['properties'][k] = schema.defaults[k].prop_dict()
 
             indexes[idx]['mappings'].update(sc_body)
 
@@ -165,7 +176,8 @@ class Mapper(object):
                 idx))  # have to use the index name as the key to the dict even though only one is returned.  .create() only takes the mapping
 
         # map our documents
-        helpers.reindex(self._es, index, newindex, **kwargs)
+        thread_count = kwargs.pop('parallel', None) or config.bulk_thread_count
+        self._reindex(index, newindex, thread_count, **kwargs)
 
         if alias and (remap_alias or alias_name):
             if alias_exists:
@@ -173,6 +185,17 @@ class Mapper(object):
 
             self._esc.put_alias(name=alias, index=newindex)
 
+    # same as helpers.reindex() but the bulk requests retry rejected documents and can be sent from multiple threads
+    def _reindex(self, index, newindex, thread_count, query=None, target_client=None, chunk_size=None,
+                          scroll='5m', scan_kwargs=None, bulk_kwargs=None):
+        hits = helpers.scan(self._es, query=query, index=index, scroll=scroll, **(scan_kwargs or {}))
+
+        actions = ({'_op_type': 'index', '_index': newindex, '_type': h['_type'], '_id': h['_id'],
+                    '_source': h['_source']} for h in hits)
+
+        return bulk.bulk(target_client or self._es, actions, chunk_size=chunk_size, thread_count=thread_count,
+                         **(bulk_kwargs or {}))
+
     def get_subclasses(self, cls, subs):
         subs.extend(all_subclasses(cls))
 
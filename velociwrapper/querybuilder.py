@@ -1,6 +1,5 @@
 from __future__ import absolute_import, unicode_literals
 from six import iteritems
-import copy
 from . import qdsl
 
 
@@ -11,6 +10,7 @@ class QueryBody(object):
         self._bool = 'must'
         self._last_part = '_query'
         self._explicit = None
+        self._built = None  # output of build() until the next chain()
 
     def __bool__(self):
         # Python 3.x version of __nonzero__
@@ -21,6 +21,7 @@ class QueryBody(object):
         return self.__bool__()
 
     def chain(self, newpart, **kwargs):
+        self._built = None
 
         condition_map = {'must': 'and', 'should': 'or', 'must_not': 'not'}
         condition_rev_map = {'and': 'must', 'or': 'should', 'not': 'must_not'}
@@ -142,7 +143,16 @@ class QueryBody(object):
                 return True
 
     def build(self):
-        q = {}
+        """
+        Returns the query body. The result is kept until chain() is called
+        again so it must not be changed. Copy it first
+        """
+        if self._built is None:
+            self._built = self._build()
+
+        return self._built
+
+    def _build(self):
         is_filtered = False
         is_query = False
         filter_is_multi_condition = False
@@ -159,9 +169,10 @@ class QueryBody(object):
         q_type = None
         f_type = None
 
-        # copy the filters and queries so the chain is still intact. Need so collections act the same as before
-        _query = copy.deepcopy(self._query)
-        _filter = copy.deepcopy(self._filter)
+        # copy the filters and queries so the chain is still intact. Need so collections act the same as before.
+        # The condition lists are copied because chain() appends to them. The clauses themselves are shared
+        _query = dict((k, list(v) if isinstance(v, list) else v) for k, v in iteritems(self._query))
+        _filter = dict((k, list(v) if isinstance(v, list) else v) for k, v in iteritems(self._filter))
 
         for t in ['and', 'or', 'not', 'must', 'should', 'must_not']:
             try:
@@ -49,8 +49,7 @@ class relationship(object):
             else:
                 dict_params[k] = None
 
-    def execute(self, cur_inst):
-
+    def _get_ref_model(self):
         # first pass we'll need the reference model
         if not self.ref_model:
             self.ref_model = self._find_related_class(self.ref_model_str)
@@ -58,7 +57,10 @@ class relationship(object):
         if not self.ref_model:
             raise AttributeError('Invalid relatonship. Could not find %s.' % self.ref_model_str)
 
-        c = self.ref_model.collection()
+        return self.ref_model
+
+    def execute(self, cur_inst):
+        c = self._get_ref_model()._create_collection()
         filter_params = {}
         possible_by_id = False
         for k, v in iteritems(self.params):
@@ -98,6 +100,7 @@ class relationship(object):
             srch = c.filter_by(**filter_params)
 
             if self.reltype == 'one':
+                from .base import NoResultsFound  # base imports this module
                 try:
                     value = srch.one()
                 except NoResultsFound:
@@ -106,3 +109,100 @@ class relationship(object):
                 value = srch.all()
 
         return value
+
+    # returns (related field, [(instance, value)], unique values) for the instances that
+    # can be loaded together or None if the relationship can't be batched
+    def preload_keys(self, instances):
+        # only relationships on a single key are batched. Others load when accessed
+        if len(self.params) != 1:
+            return None
+
+        k, v = next(iteritems(self.params))
+
+        pairs = []
+        values = []
+        seen = set()
+        for inst in instances:
+            column_value = getattr(inst, k)
+
+            # empty values and lists of anything but ids are left to execute()
+            if not column_value or (isinstance(column_value, list) and v != 'id'):
+                continue
+
+            pairs.append((inst, column_value))
+            for item in (column_value if isinstance(column_value, list) else [column_value]):
+                if item not in seen:
+                    seen.add(item)
+                    values.append(item)
+
+        return v, pairs, values
+
+    # keeps the related objects on each instance so reading the attribute doesn't query
+    def attach(self, name, field, pairs, related, limit=None):
+        found = {}
+        for obj in related:
+            column_value = getattr(obj, field)
+            for item in (column_value if isinstance(column_value, list) else [column_value]):
+                found.setdefault(item, []).append(obj)
+
+        for inst, column_value in pairs:
+            if isinstance(column_value, list):
+                value = [found[item][0] for item in column_value if item in found]
+            elif field == 'id' or self.reltype == 'one':
+                value = found.get(column_value, [None])[0]
+            else:
+                value = found.get(column_value, [])[:limit]
+
+            inst.__dict__.setdefault('_preloaded', {})[name] = value
+
+    def preload(self, name, instances):
+        """
+        Loads the relationship for all the instances with a single request
+        (mget for ids, otherwise one filter_by() on all the values). The search
+        reads at most as many hits as execute() would for each value. If more
+        match nothing is preloaded and each instance queries when it is read
+        """
+        keys = self.preload_keys(instances)
+        if not keys or not keys[2]:
+            return
+
+        field, pairs, values = keys
+        c = self._get_ref_model()._create_collection()
+        if field == 'id':
+            related = c.get_in(values)
+        else:
+            size = len(values) * (1 if self.reltype == 'one' else c.results_per_page)
+            related = c.filter_by(**{field: values}).all(size=size)
+            if self._total_hits(related.results()) > len(related):
+                return
+
+        self.attach(name, field, pairs, related, limit=c.results_per_page)
+
+    @staticmethod
+    def _total_hits(results):
+        # an object with the value and relation since Elasticsearch 7.0
+        total = results['hits'].get('total') or 0
+        return total.get('value', 0) if isinstance(total, dict) else total
+
+
+class load(object):
+    """
+    Option for VWCollection.options(). Loads the named relationships for every
+    model in the results at once instead of a request per model
+    """
+
+    def __init__(self, *names):
+        self.names = names
+
+    # yields (name, relationship) for the names
+    def relationships(self, model):
+        for name in self.names:
+            rel = model.__schema__.defaults.get(name)
+            if not isinstance(rel, relationship):
+                raise AttributeError('%s is not a relationship of %s' % (name, model.__name__))
+
+            yield name, rel
+
+    def apply(self, model, instances):
+        for name, rel in self.relationships(model):
+            rel.preload(name, instances)
@@ -0,0 +1,174 @@
+""" unit of work. Collects model commits and sends them in bulk """
+
+from __future__ import absolute_import, unicode_literals
+
+from elasticsearch import helpers
+
+from . import bulk, identity, cache, connection
+from .context import ContextStack
+
+# stack of active sessions for each task and thread
+_stack = ContextStack('vw_sessions')
+
+
+def current_session():
+    """ Returns the active VWSession for the task or thread or None """
+    return _stack.top()
+
+
+class VWSession(object):
+    """
+    Tracks new, changed and deleted models and saves them with one bulk
+    request per connection on flush().
+
+    Inside ``with VWSession():`` calling commit() on a model adds it to the
+    session instead of sending a request. The session is flushed when the
+    block exits without an exception::
+
+        with VWSession():
+            for user in users:
+                user.visits += 1
+                user.commit()  # nothing sent yet
+        # one bulk request with an update for each user
+
+    New models are indexed, deleted models are deleted and existing models
+    are sent as an update with only the fields that changed. Models that
+    didn't change are skipped. Models with __check_version__ are sent with
+    their version and fail on a conflict.
+    """
+
+    def __init__(self, chunk_size=None, raise_on_error=True, retry_on_conflict=None):
+        self.chunk_size = chunk_size
+        self.retry_on_conflict = retry_on_conflict
+        self.raise_on_error = raise_on_error
+        self._models = []
+        self._ids = set()  # id() of the models so they are only added once
+
+    def __enter__(self):
+        _stack.push(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _stack.remove(self)
+        if exc_type is None:
+            self.flush()
+        else:
+            self.clear()
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, model):
+        return id(model) in self._ids
+
+    def add(self, *models):
+        for model in models:
+            if id(model) not in self._ids:
+                self._ids.add(id(model))
+                self._models.append(model)
+
+        return self
+
+    def delete(self, model):
+        model.delete()
+        return self.add(model)
+
+    def clear(self):
+        """ Forgets the models without saving them """
+        self._models = []
+        self._ids = set()
+
+    # returns the bulk action for a model or None if nothing changed
+    def _create_action(self, model):
+        action = self._create_model_action(model)
+        if action is not None and model.__check_version__:
+            if model._new and action['_op_type'] == 'index':
+                action['_op_type'] = 'create'
+            elif not model._new:
+                for k, v in model._create_version_params().items():
+                    action['_' + k] = v
+
+        return action
+
+    def _create_model_action(self, model):
+        if model._deleted:
+            if not model.id:
+                return None
+
+            model.execute_callbacks('on_delete')
+            return {'_op_type': 'delete', '_index': model.__index__, '_type': model.__type__, '_id': model.id}
+
+        if model._new:
+            model._check_deferred()
+            model.execute_callbacks('before_commit')
+            return {'_op_type': 'index', '_index': model.__index__, '_type': model.__type__, '_id': model.id,
+                    '_source': model._document}
+
+        if not model._changed_fields():
+            return None
+
+        model._check_deferred()
+        model.execute_callbacks('before_commit')
+        action = {'_op_type': 'update', '_index': model.__index__, '_type': model.__type__, '_id': model.id}
+        action.update(model._create_update_body())
+        if self.retry_on_conflict is not None:
+            action['_retry_on_conflict'] = self.retry_on_conflict
+
+        return action
+
+    def flush(self):
+        """
+        Sends the changes. Returns a tuple of the number of documents saved
+        and a list of the failures (BulkIndexError is raised instead when
+        raise_on_error is True). Models that failed stay in the session
+        """
+        # one bulk request per connection
+        pending = {}
+        order = []
+        for model in self._models:
+            action = self._create_action(model)
+            if action is None:
+                continue
+
+            if model.__connection__ not in pending:
+                pending[model.__connection__] = []
+                order.append(model.__connection__)
+
+            pending[model.__connection__].append((model, action))
+
+        success = 0
+        errors = []
+        failed = []
+        for name in order:
+            items = pending[name]
+            results = bulk.streaming_bulk(connection.get_connection(name), [a for m, a in items],
+                                          chunk_size=self.chunk_size)
+
+            for (model, action), (ok, item) in zip(items, results):
+                identity.discard(action['_index'], action['_type'], action['_id'])
+                cache.invalidate(action['_index'])
+
+                if not ok:
+                    errors.append(item)
+                    failed.append(model)
+                    continue
+
+                success += 1
+                if action['_op_type'] == 'delete':
+                    continue
+
+                for info in item.values():
+                    model._set_version(info)
+
+                object.__setattr__(model, '_new', False)
+                model._reset_changes()
+                model._watch = True
+                model.execute_callbacks('after_commit')
+
+        self.clear()
+        self.add(*failed)
+
+        if errors and self.raise_on_error:
+            raise helpers.BulkIndexError('%i document(s) failed to save.' % len(errors), errors)
+
+        return success, errors